@@ -2,91 +2,223 @@
 VantaVault - Animation Controller
 Handles unlock animations and transitions
 """
-import time
+from time import monotonic
 import secrets
-import json
-from datetime import datetime, timedelta
+import array
+import bisect
+import threading
+import sys
+from types import MappingProxyType
+from functools import lru_cache
+
+# Unlock tokens are short-lived; expiries are kept as monotonic seconds
+TOKEN_TTL_SECONDS = 300.0
+# Hard cap on live tokens. This also bounds the index dict's size, so its
+# table stops resizing once it has grown to this many entries.
+MAX_TOKENS = 10000
+
+# Token-bucket limits for generate_token (tokens/sec, burst size)
+TOKEN_RATE = 1000.0
+TOKEN_BURST = 2000.0
+
+# Background sweep of expired tokens
+CLEANUP_INTERVAL_SECONDS = 30.0
+CLEANUP_BATCH_SIZE = 200
+
+# The unlock sequence never changes, so build it once
+_UNLOCK_SEQUENCE_DATA = {
+    'sequence': [
+        {
+            'type': 'scan',
+            'duration': 1.5,
+            'properties': {
+                'color': '#00ff00',
+                'width': '80%',
+                'height': '2px'
+            }
+        },
+        {
+            'type': 'glow',
+            'duration': 1.0,
+            'properties': {
+                'color': 'rgba(0, 255, 0, 0.3)',
+                'spread': '50px'
+            }
+        },
+        {
+            'type': 'expand',
+            'duration': 0.8,
+            'properties': {
+                'scale': 1.2
+            }
+        },
+        {
+            'type': 'fade',
+            'duration': 0.5,
+            'properties': {
+                'opacity': 0
+            }
+        }
+    ],
+    'total_duration': 3.8
+}
+def _freeze(value):
+    """Recursively convert dicts/lists into read-only mappings/tuples,
+    interning string keys and values"""
+    if isinstance(value, dict):
+        return MappingProxyType({sys.intern(k): _freeze(v) for k, v in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+# Shared by every caller, so hand out an immutable view
+_UNLOCK_SEQUENCE = _freeze(_UNLOCK_SEQUENCE_DATA)
+
+@lru_cache(maxsize=None)
+def _unlock_sequence_json():
+    """Serialize the unlock sequence on first use and reuse the bytes"""
+    import json
+    return json.dumps(_UNLOCK_SEQUENCE_DATA, separators=(',', ':')).encode('utf-8')
+
+class RateLimitExceeded(Exception):
+    """Raised when animation tokens are requested faster than allowed"""
+    pass
 
 class AnimationController:
+    __slots__ = (
+        '_lock', '_tokens', '_expiries', '_base', 'animation_tokens',
+        '_bucket_capacity', '_bucket_rate', '_bucket_tokens', '_bucket_last',
+        '_stopping', '_cleanup_thread',
+    )
+    
     def __init__(self):
+        # Tokens are stored structure-of-arrays style: parallel token and
+        # expiry arrays in creation order, plus a token -> sequence number
+        # index. Every token shares the same TTL, so creation order is also
+        # expiry order and expired tokens always form a prefix of the arrays.
+        # The lock guards the arrays and bucket, which Flask's threaded server
+        # touches concurrently.
+        self._lock = threading.Lock()
+        self._tokens = []
+        self._expiries = array.array('d')
+        self._base = 0  # sequence number of self._tokens[0]
         self.animation_tokens = {}
+        
+        # Token bucket guarding generate_token
+        self._bucket_capacity = TOKEN_BURST
+        self._bucket_rate = TOKEN_RATE
+        self._bucket_tokens = TOKEN_BURST
+        self._bucket_last = monotonic()
+        
+        # Sweep expired tokens off the request path
+        self._stopping = threading.Event()
+        self._cleanup_thread = threading.Thread(
+            target=self._cleanup_loop,
+            name='animation-token-cleanup',
+            daemon=True
+        )
+        self._cleanup_thread.start()
+    
+    def _cleanup_loop(self):
+        """Periodically remove expired tokens in small batches"""
+        while not self._stopping.wait(CLEANUP_INTERVAL_SECONDS):
+            # Release the lock between batches so requests are not stalled
+            while self.cleanup_expired_tokens(batch_size=CLEANUP_BATCH_SIZE):
+                pass
+    
+    def close(self):
+        """Stop the background cleanup thread"""
+        self._stopping.set()
     
     def generate_token(self):
         """Generate animation token for unlock"""
-        token = secrets.token_urlsafe(32)
-        expiry = datetime.now() + timedelta(minutes=5)
-        self.animation_tokens[token] = {
-            'expiry': expiry,
-            'used': False
-        }
-        return token
+        with self._lock:
+            now = monotonic()
+            self._bucket_tokens = min(
+                self._bucket_capacity,
+                self._bucket_tokens + (now - self._bucket_last) * self._bucket_rate
+            )
+            self._bucket_last = now
+            if self._bucket_tokens < 1.0:
+                raise RateLimitExceeded('Too many unlock requests')
+            self._bucket_tokens -= 1.0
+            
+            # Key tokens internally by a random 64-bit int (cheap to hash);
+            # clients see it as 16 hex digits
+            key = secrets.randbits(64)
+            while key in self.animation_tokens:
+                key = secrets.randbits(64)
+            
+            self.animation_tokens[key] = self._base + len(self._tokens)
+            self._tokens.append(key)
+            self._expiries.append(now + TOKEN_TTL_SECONDS)
+            
+            # Cap memory by evicting the oldest (soonest to expire) tokens
+            if len(self._tokens) > MAX_TOKENS:
+                self._drop_oldest(len(self._tokens) - MAX_TOKENS)
+        return f'{key:016x}'
     
     def validate_token(self, token):
         """Validate animation token"""
-        if token not in self.animation_tokens:
+        if not token or len(token) != 16:
+            return False
+        try:
+            key = int(token, 16)
+        except ValueError:
             return False
         
-        token_data = self.animation_tokens[token]
+        # Tokens are single-use: popping the index entry consumes the token
+        # atomically, so two concurrent requests can never both succeed
+        seq = self.animation_tokens.pop(key, None)
+        if seq is None:
+            return False
         
         # Check expiry
-        if datetime.now() > token_data['expiry']:
-            del self.animation_tokens[token]
-            return False
+        with self._lock:
+            offset = seq - self._base
+            if offset < 0:
+                # Already swept out of the arrays by cleanup or eviction
+                return False
+            expiry = self._expiries[offset]
         
-        # Check if already used
-        if token_data['used']:
-            return False
+        return monotonic() <= expiry
+    
+    def _drop_oldest(self, count):
+        """Remove the count oldest entries from the token arrays (lock held)"""
+        index = self.animation_tokens
+        for seq, key in enumerate(self._tokens[:count], self._base):
+            # Skip keys that were consumed and later re-issued. validate_token
+            # pops without the lock, so the key may vanish after the check
+            if index.get(key) == seq:
+                index.pop(key, None)
         
-        # Mark as used
-        token_data['used'] = True
-        return True
+        del self._tokens[:count]
+        del self._expiries[:count]
+        self._base += count
     
     def get_unlock_animation_sequence(self):
-        """Get unlock animation sequence"""
-        return {
-            'sequence': [
-                {
-                    'type': 'scan',
-                    'duration': 1.5,
-                    'properties': {
-                        'color': '#00ff00',
-                        'width': '80%',
-                        'height': '2px'
-                    }
-                },
-                {
-                    'type': 'glow',
-                    'duration': 1.0,
-                    'properties': {
-                        'color': 'rgba(0, 255, 0, 0.3)',
-                        'spread': '50px'
-                    }
-                },
-                {
-                    'type': 'expand',
-                    'duration': 0.8,
-                    'properties': {
-                        'scale': 1.2
-                    }
-                },
-                {
-                    'type': 'fade',
-                    'duration': 0.5,
-                    'properties': {
-                        'opacity': 0
-                    }
-                }
-            ],
-            'total_duration': 3.8
-        }
+        """Get unlock animation sequence (read-only; copy before modifying)"""
+        return _UNLOCK_SEQUENCE
+    
+    def get_unlock_animation_json(self):
+        """Get unlock animation sequence as pre-serialized JSON bytes"""
+        return _unlock_sequence_json()
     
-    def cleanup_expired_tokens(self):
-        """Clean up expired animation tokens"""
-        now = datetime.now()
-        expired_tokens = [
-            token for token, data in self.animation_tokens.items()
-            if now > data['expiry']
-        ]
+    def cleanup_expired_tokens(self, batch_size: int = 100) -> bool:
+        """Clean up expired animation tokens, at most batch_size per call.
         
-        for token in expired_tokens:
-            del self.animation_tokens[token]
\ No newline at end of file
+        Returns True if the batch filled up and more tokens may be expired.
+        """
+        with self._lock:
+            now = monotonic()
+            expiries = self._expiries
+            
+            # Expiries are sorted, so binary-search for the end of the expired prefix
+            count = min(bisect.bisect_right(expiries, now), batch_size)
+            
+            if count:
+                self._drop_oldest(count)
+            
+            return count == batch_size and bool(expiries) and expiries[0] <= now
\ No newline at end of file
@@ -5,31 +5,80 @@ Complete version for Termux with Fingerprint Support
 import os
 import sqlite3
 import json
+import re
 import time
-import random
+import secrets
 from datetime import datetime, timedelta
-from functools import wraps
+from functools import wraps, lru_cache
 import base64
 import sys
+import socket
+import threading
+import queue
+import atexit
+from concurrent.futures import ThreadPoolExecutor
+import logging
+from logging.handlers import RotatingFileHandler, MemoryHandler
 from pathlib import Path
 
-from flask import Flask, render_template, request, jsonify, session, send_file, Response, redirect, send_from_directory
+from flask import Flask, render_template, request, jsonify, session, send_file, Response, redirect, send_from_directory, stream_with_context, g
+from flask.json.provider import DefaultJSONProvider
+from flask.logging import default_handler
 from werkzeug.utils import secure_filename
 
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+try:
+    from waitress import serve
+    WAITRESS_AVAILABLE = True
+except ImportError:
+    WAITRESS_AVAILABLE = False
+
 # Import custom modules
 from vault import VaultManager
 from encryption import EncryptionManager
-from pwa import PWA_Manager
-from animations import AnimationController
-from fingerprint import WebAuthnManager  # Added fingerprint support
+from pwa import PWA_Manager, ensure_gzip_copy
+from animations import AnimationController, RateLimitExceeded
+from fingerprint import WebAuthnManager, WEBAUTHN_AVAILABLE, webauthn_available  # Added fingerprint support
+from sessions import SessionStore
+
+class ORJSONProvider(DefaultJSONProvider):
+    """jsonify() backed by orjson, honouring the provider's sort/indent settings"""
+    
+    def dumps(self, obj, **kwargs):
+        option = orjson.OPT_NON_STR_KEYS
+        if kwargs.get('sort_keys', self.sort_keys):
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get('indent'):
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=kwargs.get('default', self.default),
+                            option=option).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 # Initialize Flask app
 app = Flask(__name__)
+if ORJSON_AVAILABLE:
+    app.json_provider_class = ORJSONProvider
+    app.json = ORJSONProvider(app)
+# API clients don't need sorted keys or indentation, even in debug mode
+app.json.sort_keys = False
+app.json.compact = True
+
 app.secret_key = os.urandom(24)
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max upload for Termux
 app.config['UPLOAD_FOLDER'] = 'uploads/'
 app.config['ENCRYPTED_STORAGE'] = 'encrypted_storage/'
 app.config['DATABASE'] = 'database/vantavault.db'
+app.config['LOG_FILE'] = 'logs/vantavault.log'
+# Behind nginx, set to an internal location (e.g. '/internal/') aliased to
+# the app directory so stored files are sent by nginx with sendfile(2)
+app.config['X_ACCEL_REDIRECT_PREFIX'] = os.environ.get('X_ACCEL_REDIRECT_PREFIX')
 app.config['SESSION_TYPE'] = 'filesystem'
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
 
@@ -38,6 +87,28 @@ app.config['WEBAUTHN_RP_ID'] = 'localhost'  # For production: your-domain.com
 app.config['WEBAUTHN_RP_NAME'] = 'VantaVault'
 app.config['WEBAUTHN_ORIGIN'] = 'http://localhost:5000'  # For production: https://your-domain.com
 
+# Resolved once at startup; request handlers never create directories
+_UPLOAD_DIR = Path(app.config['UPLOAD_FOLDER'])
+_ENCRYPTED_REAL = Path(app.config['ENCRYPTED_STORAGE']) / 'real'
+_ENCRYPTED_FAKE = Path(app.config['ENCRYPTED_STORAGE']) / 'fake'
+_DATABASE_DIR = Path(app.config['DATABASE']).parent
+
+# Ensure directories exist (before the managers open the database)
+for directory in [_UPLOAD_DIR, _ENCRYPTED_REAL, _ENCRYPTED_FAKE, _DATABASE_DIR,
+                  Path('static/css'), Path('static/js'), Path('static/icons')]:
+    directory.mkdir(parents=True, exist_ok=True)
+
+_LOG_DIR = Path(app.config['LOG_FILE']).parent
+_LOG_DIR.mkdir(parents=True, exist_ok=True)
+
+# Log records are buffered and written in batches of 64; errors flush the
+# buffer straight away so nothing is lost if the process dies afterwards
+_log_file_handler = RotatingFileHandler(app.config['LOG_FILE'], maxBytes=1024 * 1024, backupCount=3)
+_log_file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+app.logger.removeHandler(default_handler)
+app.logger.addHandler(MemoryHandler(64, flushLevel=logging.ERROR, target=_log_file_handler))
+app.logger.setLevel(logging.INFO)
+
 # Initialize managers
 vault_manager = VaultManager(app.config['DATABASE'])
 encryption_manager = EncryptionManager()
@@ -45,72 +116,237 @@ pwa_manager = PWA_Manager(app)
 animations = AnimationController()
 webauthn_manager = WebAuthnManager(app)  # Initialize fingerprint manager
 
-# Ensure directories exist
-for directory in ['uploads', 'encrypted_storage/real', 'encrypted_storage/fake', 'database', 'static/css', 'static/js', 'static/icons']:
-    os.makedirs(directory, exist_ok=True)
+# Session tracking (in memory only: the cookie secret key is regenerated on
+# every start, so sessions could not outlive a restart anyway)
+active_sessions = SessionStore(
+    timeout=1800,  # 30 min inactivity timeout
+    maxsize=10000
+)
+
+# PINs rejected at setup / change time
+_WEAK_PINS = frozenset({
+    '123456', '654321', '000000', '111111', '222222', '333333',
+    '444444', '555555', '666666', '777777', '888888', '999999',
+    '123123', '112233', '121212'
+})
+_SEQUENTIAL_PINS = frozenset({
+    '012345', '123456', '234567', '345678', '456789', '567890',
+    '098765', '987654', '876543', '765432', '654321', '543210'
+})
+
+def _build_pin_bitmap(pins):
+    """Build a 1,000,000-bit lookup table (one bit per 6-digit PIN)"""
+    bitmap = bytearray(125000)
+    for pin in pins:
+        value = int(pin)
+        bitmap[value >> 3] |= 1 << (value & 7)
+    return bytes(bitmap)
+
+def _pin_in_bitmap(bitmap, pin):
+    """Check a validated 6-digit PIN against a bitmap from _build_pin_bitmap"""
+    value = int(pin)
+    return bool(bitmap[value >> 3] & (1 << (value & 7)))
+
+# Bitmaps keep lookups constant-cost however large the lists grow
+_WEAK_PIN_BITMAP = _build_pin_bitmap(_WEAK_PINS)
+_SEQUENTIAL_PIN_BITMAP = _build_pin_bitmap(_SEQUENTIAL_PINS)
 
-# Session tracking
-active_sessions = {}
+# Exactly six ASCII digits, not all the same one
+_PIN_RE = re.compile(r'(?!([0-9])\1{5})[0-9]{6}')
+
+def _validate_pin(pin):
+    """Return an error message for an unacceptable new PIN, else None"""
+    if not isinstance(pin, str) or not _PIN_RE.fullmatch(pin):
+        if isinstance(pin, str) and len(pin) == 6 and pin[0] * 6 == pin and pin.isdigit():
+            return 'PIN is too simple'
+        return 'PIN must be 6 digits'
+    
+    if _pin_in_bitmap(_WEAK_PIN_BITMAP, pin):
+        return 'PIN is too common'
+    
+    if _pin_in_bitmap(_SEQUENTIAL_PIN_BITMAP, pin):
+        return 'PIN is too predictable'
+    
+    return None
+
+# One SQLite connection per worker thread, reused across requests
+_db_local = threading.local()
+
+def get_db():
+    """Get this thread's cached database connection (WAL, autocommit)"""
+    conn = getattr(_db_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(
+            app.config['DATABASE'],
+            check_same_thread=False,
+            isolation_level=None
+        )
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=5000')
+        _db_local.conn = conn
+    return conn
+
+# Once a PIN has been set the app stays initialized for the process lifetime
+_first_time_cache = None
 
 def is_first_time():
     """Check if this is the first time app is launched"""
+    global _first_time_cache
+    if _first_time_cache is not None:
+        return _first_time_cache
+    
     # Check if database file exists
     if not os.path.exists(app.config['DATABASE']):
         return True
     
-    conn = sqlite3.connect(app.config['DATABASE'])
-    cursor = conn.cursor()
+    cursor = get_db().cursor()
     
     try:
-        # Check if real_vault_settings table exists
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='real_vault_settings'")
-        if not cursor.fetchone():
-            return True
+        # VaultManager stamps user_version once the vault is set up
+        cursor.execute('PRAGMA user_version')
+        if cursor.fetchone()[0] == 0:
+            # An older vault whose schema migration failed is still at 0;
+            # a PIN row means it is set up, so fail closed
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='real_vault_settings'")
+            if not cursor.fetchone():
+                return True
+            cursor.execute('SELECT 1 FROM real_vault_settings LIMIT 1')
+            if cursor.fetchone() is None:
+                return True
         
-        # Check if any PIN is set
-        cursor.execute("SELECT pin_hash FROM real_vault_settings LIMIT 1")
-        result = cursor.fetchone()
-        return result is None or result[0] is None
+        # Only the initialized state is cached; setup can still flip it
+        _first_time_cache = False
+        return False
         
     except sqlite3.Error:
         return True
-    finally:
-        conn.close()
 
 def requires_auth(f):
-    """Decorator to require authentication"""
+    """Decorator to require authentication
+    
+    Exposes the resolved session as g.session_id / g.session_data, and its
+    vault type as g.vault_type, so route bodies don't need to look it up again.
+    """
     @wraps(f)
     def decorated(*args, **kwargs):
         session_id = session.get('session_id')
-        if not session_id or session_id not in active_sessions:
-            # Check for fingerprint authentication in session
-            if not session.get('fingerprint_authenticated'):
-                return jsonify({'error': 'Authentication required'}), 401
+        session_data = active_sessions.get(session_id) if session_id else None
+        if session_data is None:
+            return jsonify({'error': 'Authentication required'}), 401
         
-        session_data = active_sessions.get(session_id)
-        if session_data:
-            if time.time() - session_data['last_activity'] > 1800:  # 30 min timeout
-                del active_sessions[session_id]
-                session.clear()
-                return jsonify({'error': 'Session expired'}), 401
-            
-            # Update last activity
-            session_data['last_activity'] = time.time()
+        if active_sessions.is_expired(session_id):
+            del active_sessions[session_id]
+            session.clear()
+            return jsonify({'error': 'Session expired'}), 401
+        
+        # Update last activity
+        active_sessions.touch(session_id)
         
+        g.session_id = session_id
+        g.session_data = session_data
+        g.vault_type = session_data['vault_type']
         return f(*args, **kwargs)
     return decorated
 
+def vault_routed(real_template, fake_template='fake_vault.html'):
+    """Decorator for page routes: render real_template for the real vault
+    and fake_template for the decoy (use beneath requires_auth)
+    """
+    templates = {'real': real_template, 'fake': fake_template}
+    
+    def decorator(f):
+        @wraps(f)
+        def decorated(*args, **kwargs):
+            return render_template(templates[g.vault_type])
+        return decorated
+    return decorator
+
+# Second-resolution local ISO timestamp, reformatted at most once a second
+_iso_cache = (0, '')
+
+def iso_now():
+    """Current local time as 'YYYY-MM-DDTHH:MM:SS'"""
+    global _iso_cache
+    now = int(time.time())
+    cached_second, cached_text = _iso_cache
+    if now != cached_second:
+        cached_text = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(now))
+        _iso_cache = (now, cached_text)
+    return cached_text
+
+# Auth log rows are queued by request handlers and written in batches
+# by a background thread, keeping the INSERT + commit off the response path
+AUTH_LOG_BATCH_SIZE = 32
+AUTH_LOG_FLUSH_SECONDS = 0.1
+_auth_log_queue = queue.Queue()
+
+_AUTH_LOG_INSERT = '''
+    INSERT INTO auth_logs (timestamp, attempt_type, success, ip_address, user_agent)
+    VALUES (?, ?, ?, ?, ?)
+'''
+
 def log_auth_attempt(attempt_type, success, ip_address, user_agent):
     """Log authentication attempts for security"""
-    conn = sqlite3.connect(app.config['DATABASE'])
-    cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO auth_logs (timestamp, attempt_type, success, ip_address, user_agent)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (datetime.now().isoformat(), attempt_type, 
-          success, ip_address, user_agent))
-    conn.commit()
-    conn.close()
+    _auth_log_queue.put((iso_now(), attempt_type,
+                         success, ip_address, user_agent))
+
+def _write_auth_logs(rows):
+    """Insert a batch of auth log rows in a single transaction"""
+    db = get_db()
+    try:
+        db.execute('BEGIN')
+        db.executemany(_AUTH_LOG_INSERT, rows)
+        db.execute('COMMIT')
+    except sqlite3.Error:
+        if db.in_transaction:
+            db.execute('ROLLBACK')
+        # Retry row by row so one bad row doesn't drop the whole batch
+        for row in rows:
+            try:
+                db.execute(_AUTH_LOG_INSERT, row)
+            except sqlite3.Error as e:
+                app.logger.error("Auth log error: %s", e)
+
+def _auth_log_writer():
+    """Drain the auth log queue, flushing every batch or flush interval"""
+    stopping = False
+    while not stopping:
+        rows = [_auth_log_queue.get()]
+        deadline = time.monotonic() + AUTH_LOG_FLUSH_SECONDS
+        
+        while len(rows) < AUTH_LOG_BATCH_SIZE:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                rows.append(_auth_log_queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        
+        # None is the shutdown sentinel queued by _stop_auth_log_writer
+        if None in rows:
+            stopping = True
+            rows = [row for row in rows if row is not None]
+        if rows:
+            _write_auth_logs(rows)
+
+_auth_log_thread = threading.Thread(target=_auth_log_writer, name='auth-log-writer', daemon=True)
+_auth_log_thread.start()
+
+@atexit.register
+def _stop_auth_log_writer():
+    """Flush queued auth logs before the process exits"""
+    _auth_log_queue.put(None)
+    _auth_log_thread.join(timeout=5)
+
+def _animation_token():
+    """{'animation_token': ...} for an unlock response, or {} when tokens are
+    being requested too fast; the unlock itself has already succeeded"""
+    try:
+        return {'animation_token': animations.generate_token()}
+    except RateLimitExceeded:
+        return {}
 
 def get_client_info(request):
     """Get client IP and user agent"""
@@ -139,6 +375,7 @@ def setup():
 @app.route('/api/setup/pin', methods=['POST'])
 def setup_pin():
     """Setup initial PIN for first-time users"""
+    global _first_time_cache
     if not is_first_time():
         return jsonify({'error': 'Already initialized'}), 400
     
@@ -150,33 +387,21 @@ def setup_pin():
     if not pin or not confirm_pin:
         return jsonify({'error': 'PIN required'}), 400
     
-    if len(pin) != 6 or not pin.isdigit():
-        return jsonify({'error': 'PIN must be 6 digits'}), 400
+    error = _validate_pin(pin)
+    if error:
+        return jsonify({'error': error}), 400
     
-    if pin != confirm_pin:
+    # Constant-time, so response timing doesn't reveal how much matched
+    if not isinstance(confirm_pin, str) or not secrets.compare_digest(pin.encode(), confirm_pin.encode()):
         return jsonify({'error': 'PINs do not match'}), 400
     
-    # Check for simple patterns
-    if len(set(pin)) == 1:  # All same digit
-        return jsonify({'error': 'PIN is too simple'}), 400
-    
-    if pin in ['123456', '654321', '000000', '111111', '222222', '333333', 
-               '444444', '555555', '666666', '777777', '888888', '999999',
-               '123123', '112233', '121212']:
-        return jsonify({'error': 'PIN is too common'}), 400
-    
-    # Check for sequential numbers
-    if pin in ['012345', '123456', '234567', '345678', '456789', '567890',
-               '098765', '987654', '876543', '765432', '654321', '543210']:
-        return jsonify({'error': 'PIN is too predictable'}), 400
-    
     try:
         # Initialize database
-        print("Initializing database...")
+        app.logger.info("Initializing database...")
         vault_manager.initialize_database()
         
         # Generate random fake PIN
-        fake_pin = ''.join([str(random.randint(0, 9)) for _ in range(6)])
+        fake_pin = f'{secrets.randbelow(1_000_000):06d}'
         
         # Update real vault with user's PIN
         vault_manager.update_pin('real', pin)
@@ -185,14 +410,16 @@ def setup_pin():
         vault_manager.update_pin('fake', fake_pin)
         
         # Add fake media for decoy mode
-        print("Adding fake media...")
+        app.logger.info("Adding fake media...")
         vault_manager.add_fake_media()
         
+        _first_time_cache = False
+        
         # Get client info
         ip, user_agent = get_client_info(request)
         
         # Create session for immediate access
-        session_id = os.urandom(16).hex()
+        session_id = secrets.token_urlsafe(32)
         session['session_id'] = session_id
         session['user_id'] = session_id  # Store user_id for fingerprint
         session['vault_type'] = 'real'
@@ -209,17 +436,17 @@ def setup_pin():
         # Log the setup
         log_auth_attempt('SETUP', True, ip, user_agent)
         
-        print(f"Vault created for user. Real PIN: {pin}, Fake PIN: {fake_pin}")
+        app.logger.info("Vault created")
         
         return jsonify({
             'success': True,
             'session_id': session_id,
-            'animation_token': animations.generate_token(),
-            'message': 'Secure vault created successfully!'
+            'message': 'Secure vault created successfully!',
+            **_animation_token()
         })
         
     except Exception as e:
-        print(f"Setup error: {e}")
+        app.logger.error("Setup error: %s", e)
         return jsonify({'error': f'Setup failed: {str(e)}'}), 500
 
 # ==================== FINGERPRINT ROUTES ====================
@@ -229,14 +456,12 @@ def setup_pin():
 def fingerprint_setup():
     """Start fingerprint setup process"""
     try:
-        session_id = session.get('session_id')
-        if not session_id or session_id not in active_sessions:
-            return jsonify({'error': 'Authentication required'}), 401
+        session_id = g.session_id
         
-        user_id = active_sessions[session_id].get('user_id', session_id)
+        user_id = g.session_data.get('user_id', session_id)
         options = webauthn_manager.register_credential(user_id)
         
-        return jsonify(options)
+        return json_response(options)
         
     except Exception as e:
         return jsonify({'error': f'Fingerprint setup failed: {str(e)}'}), 500
@@ -246,8 +471,8 @@ def fingerprint_setup():
 def fingerprint_verify_setup():
     """Verify fingerprint setup"""
     try:
-        data = request.get_json()
-        result = webauthn_manager.verify_registration(data)
+        # Hand over the raw body; the WebAuthn models parse it directly
+        result = webauthn_manager.verify_registration(request.get_data(as_text=True))
         
         # Get client info for logging
         ip, user_agent = get_client_info(request)
@@ -281,7 +506,7 @@ def fingerprint_authenticate():
             return jsonify({'error': 'User not identified'}), 400
         
         result = webauthn_manager.authenticate(user_id)
-        return jsonify(result)
+        return json_response(result)
         
     except Exception as e:
         return jsonify({'error': f'Authentication failed: {str(e)}'}), 500
@@ -290,21 +515,21 @@ def fingerprint_authenticate():
 def fingerprint_verify_auth():
     """Verify fingerprint authentication"""
     try:
-        data = request.get_json()
-        result = webauthn_manager.verify_authentication(data)
+        # Hand over the raw body; the WebAuthn models parse it directly
+        result = webauthn_manager.verify_authentication(request.get_data(as_text=True))
         
         # Get client info for logging
         ip, user_agent = get_client_info(request)
         
         if result.get('success'):
             # Authentication successful - create session
-            session_id = os.urandom(16).hex()
+            session_id = secrets.token_urlsafe(32)
             session['session_id'] = session_id
             session['vault_type'] = 'real'
             session['authenticated'] = True
             session['fingerprint_authenticated'] = True
             session['auth_method'] = 'fingerprint'
-            session['auth_time'] = datetime.now().isoformat()
+            session['auth_time'] = iso_now()
             
             # Get user_id from webauthn session
             user_id = session.get('webauthn_user_id')
@@ -324,7 +549,7 @@ def fingerprint_verify_auth():
             log_auth_attempt('FINGERPRINT', True, ip, user_agent)
             
             # Add animation token for success response
-            result['animation_token'] = animations.generate_token()
+            result.update(_animation_token())
             result['session_id'] = session_id
             
         else:
@@ -340,11 +565,9 @@ def fingerprint_verify_auth():
 def fingerprint_status():
     """Check fingerprint status for current user"""
     try:
-        session_id = session.get('session_id')
-        if not session_id or session_id not in active_sessions:
-            return jsonify({'enabled': False})
+        session_id = g.session_id
         
-        user_id = active_sessions[session_id].get('user_id', session_id)
+        user_id = g.session_data.get('user_id', session_id)
         enabled = webauthn_manager.is_fingerprint_enabled(user_id)
         
         return jsonify({'enabled': enabled})
@@ -357,18 +580,12 @@ def fingerprint_status():
 def remove_fingerprint():
     """Remove fingerprint credential"""
     try:
-        session_id = session.get('session_id')
-        if not session_id or session_id not in active_sessions:
-            return jsonify({'error': 'Authentication required'}), 401
+        session_id = g.session_id
         
-        user_id = active_sessions[session_id].get('user_id', session_id)
+        user_id = g.session_data.get('user_id', session_id)
         
         # Remove credentials from database
-        conn = sqlite3.connect(app.config['DATABASE'])
-        cursor = conn.cursor()
-        cursor.execute('DELETE FROM webauthn_credentials WHERE user_id = ?', (user_id,))
-        conn.commit()
-        conn.close()
+        webauthn_manager.remove_credentials(user_id)
         
         return jsonify({'success': True, 'message': 'Fingerprint removed'})
         
@@ -401,7 +618,7 @@ def verify_pin():
     
     if vault_type == 'real':
         # Create session for real vault
-        session_id = os.urandom(16).hex()
+        session_id = secrets.token_urlsafe(32)
         session['session_id'] = session_id
         session['user_id'] = session_id  # Store user_id for fingerprint
         session['vault_type'] = 'real'
@@ -420,12 +637,12 @@ def verify_pin():
             'success': True,
             'vault_type': 'real',
             'session_id': session_id,
-            'animation_token': animations.generate_token()
+            **_animation_token()
         })
     
     elif vault_type == 'fake':
         # Create session for fake vault
-        session_id = os.urandom(16).hex()
+        session_id = secrets.token_urlsafe(32)
         session['session_id'] = session_id
         session['vault_type'] = 'fake'
         session['authenticated'] = True
@@ -464,26 +681,14 @@ def unlock_animation():
 
 @app.route('/dashboard')
 @requires_auth
+@vault_routed('dashboard.html')
 def dashboard():
     """Main dashboard after unlock"""
-    session_data = active_sessions.get(session.get('session_id'))
-    if not session_data:
-        return redirect('/')
-    
-    vault_type = session_data['vault_type']
-    if vault_type == 'fake':
-        return render_template('fake_vault.html')
-    
-    return render_template('dashboard.html')
 
 @app.route('/api/media/upload', methods=['POST'])
 @requires_auth
 def upload_media():
     """Upload and encrypt media files"""
-    session_id = session.get('session_id')
-    if not session_id or session_id not in active_sessions:
-        return jsonify({'error': 'Authentication required'}), 401
-    
     if 'file' not in request.files:
         return jsonify({'error': 'No file provided'}), 400
     
@@ -496,23 +701,15 @@ def upload_media():
     # Secure filename
     filename = secure_filename(file.filename)
     
-    # Create uploads directory if it doesn't exist
-    os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-    
-    # Save file temporarily
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    file.save(file_path)
-    
-    # Encrypt and store file
+    # Encrypt straight from the upload stream (no temporary plaintext copy)
     try:
         encrypted_path, thumbnail_path = vault_manager.encrypt_and_store(
-            file_path, 
-            session_id,
-            folder_id
+            file.stream,
+            filename=filename
         )
         
         # Store metadata
-        vault_type = active_sessions[session_id]['vault_type']
+        vault_type = g.vault_type
         media_id = vault_manager.store_media_metadata(
             filename,
             encrypted_path,
@@ -529,105 +726,169 @@ def upload_media():
         })
         
     except Exception as e:
-        print(f"Upload error: {e}")
+        app.logger.error("Upload error: %s", e)
         return jsonify({'error': f'Upload failed: {str(e)}'}), 500
-    finally:
-        # Clean up temp file if it exists
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except:
-                pass
+
+@app.route('/api/media/upload/init', methods=['POST'])
+@requires_auth
+def upload_init():
+    """Start a chunked, resumable upload"""
+    data = request.get_json() or {}
+    filename = secure_filename(data.get('filename', ''))
+    
+    if not filename:
+        return jsonify({'error': 'No file selected'}), 400
+    
+    try:
+        total_size = int(data.get('size', 0))
+        upload = vault_manager.begin_upload(
+            g.session_id,
+            filename,
+            total_size,
+            data.get('folder_id', 'default'),
+            max_size=app.config['MAX_CONTENT_LENGTH']
+        )
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    except OSError as e:
+        app.logger.error("Upload error: %s", e)
+        return jsonify({'error': 'Upload failed'}), 500
+    
+    return jsonify({'success': True, **upload})
+
+@app.route('/api/media/upload/part/<int:part_number>', methods=['PUT', 'POST'])
+@requires_auth
+def upload_part(part_number):
+    """Receive one part of a chunked upload (raw request body)"""
+    upload_id = request.args.get('upload_id', '')
+    
+    try:
+        received = vault_manager.write_upload_part(
+            upload_id,
+            g.session_id,
+            part_number,
+            request.get_data()
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except OSError as e:
+        app.logger.error("Upload error: %s", e)
+        return jsonify({'error': 'Upload failed'}), 500
+    
+    return jsonify({'success': True, 'part': part_number, 'received': received})
+
+@app.route('/api/media/upload/finalize', methods=['POST'])
+@requires_auth
+def upload_finalize():
+    """Finish a chunked upload and store its metadata"""
+    data = request.get_json() or {}
+    
+    try:
+        upload, thumbnail_path, missing = vault_manager.finish_upload(
+            data.get('upload_id', ''),
+            g.session_id
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except OSError as e:
+        app.logger.error("Upload error: %s", e)
+        return jsonify({'error': 'Upload failed'}), 500
+    
+    if missing:
+        # Client resends just these parts, then finalizes again
+        return jsonify({'error': 'Upload incomplete', 'missing_parts': missing}), 409
+    
+    media_id = vault_manager.store_media_metadata(
+        upload['filename'],
+        upload['encrypted_path'],
+        thumbnail_path,
+        upload['folder_id'],
+        g.vault_type
+    )
+    
+    return jsonify({
+        'success': True,
+        'media_id': media_id,
+        'filename': upload['filename'],
+        'thumbnail': thumbnail_path
+    })
 
 @app.route('/api/media/list')
 @requires_auth
 def list_media():
     """List media files in vault"""
-    session_id = session.get('session_id')
-    if not session_id or session_id not in active_sessions:
-        return jsonify({'error': 'Authentication required'}), 401
-    
-    vault_type = active_sessions[session_id]['vault_type']
+    vault_type = g.vault_type
     folder_id = request.args.get('folder_id', 'default')
     
     media_list = vault_manager.get_media_list(vault_type, folder_id)
-    return jsonify({'media': media_list})
+    return json_response({'media': media_list})
 
 @app.route('/api/media/<int:media_id>')
 @requires_auth
 def get_media(media_id):
     """Retrieve and decrypt media file"""
-    session_id = session.get('session_id')
-    if not session_id or session_id not in active_sessions:
-        return jsonify({'error': 'Authentication required'}), 401
+    session_id = g.session_id
     
-    vault_type = active_sessions[session_id]['vault_type']
+    vault_type = g.vault_type
     media_info = vault_manager.get_media_info(media_id, vault_type)
     
     if not media_info:
         return jsonify({'error': 'Media not found'}), 404
     
+    encrypted_path = media_info['encrypted_path']
+    if not encrypted_path or not os.path.exists(encrypted_path):
+        return jsonify({'error': 'Failed to retrieve media'}), 500
+    
     try:
-        # Decrypt file
-        decrypted_path = vault_manager.decrypt_media(media_info['encrypted_path'], session_id)
-        
-        # Send file
-        response = send_file(
-            decrypted_path,
+        # Decrypt on the fly while streaming; plaintext never touches disk
+        return Response(
+            stream_with_context(vault_manager.decrypt_stream(encrypted_path, session_id)),
             mimetype=media_info['mimetype'],
-            as_attachment=True,
-            download_name=media_info['filename']
+            headers={
+                'Content-Disposition': f'attachment; filename="{media_info["filename"]}"',
+                'Content-Length': str(vault_manager.plaintext_size(encrypted_path))
+            }
         )
         
-        # Schedule cleanup of temp file
-        def cleanup_temp():
-            try:
-                if os.path.exists(decrypted_path):
-                    os.remove(decrypted_path)
-            except:
-                pass
-        
-        response.call_on_close(cleanup_temp)
-        return response
-        
     except Exception as e:
-        print(f"Get media error: {e}")
+        app.logger.error("Get media error: %s", e)
         return jsonify({'error': 'Failed to retrieve media'}), 500
 
 @app.route('/api/media/thumbnail/<int:media_id>')
 @requires_auth
 def get_thumbnail(media_id):
     """Get media thumbnail"""
-    session_id = session.get('session_id')
-    if not session_id or session_id not in active_sessions:
-        return jsonify({'error': 'Authentication required'}), 401
-    
-    vault_type = active_sessions[session_id]['vault_type']
+    vault_type = g.vault_type
     media_info = vault_manager.get_media_info(media_id, vault_type)
     
-    if not media_info or not media_info.get('thumbnail_path'):
+    if not media_info or not media_info.get('thumbnail_exists'):
         # Return default thumbnail
         return send_from_directory('static/icons', 'icon-192.png')
     
+    thumbnail_path = media_info['thumbnail_path']
     try:
-        return send_file(
-            media_info['thumbnail_path'],
-            mimetype='image/jpeg',
-            as_attachment=False
-        )
-    except:
-        # Fallback to default thumbnail
+        mtime = os.path.getmtime(thumbnail_path)
+    except OSError:
+        # Deleted between the lookup and now
         return send_from_directory('static/icons', 'icon-192.png')
+    # Thumbnails never change once written, so let the browser revalidate
+    # with If-None-Match / If-Modified-Since and get a 304 instead
+    response = send_file(
+        thumbnail_path,
+        mimetype='image/jpeg',
+        as_attachment=False,
+        conditional=True,
+        etag=f'thumb-{media_id}-{int(mtime)}',
+        last_modified=mtime
+    )
+    response.headers['Cache-Control'] = 'private, max-age=86400'
+    return response
 
 @app.route('/api/media/delete/<int:media_id>', methods=['DELETE'])
 @requires_auth
 def delete_media(media_id):
     """Delete media file (move to recycle bin)"""
-    session_id = session.get('session_id')
-    if not session_id or session_id not in active_sessions:
-        return jsonify({'error': 'Authentication required'}), 401
-    
-    vault_type = active_sessions[session_id]['vault_type']
+    vault_type = g.vault_type
     
     if vault_manager.delete_media(media_id, vault_type, permanent=False):
         return jsonify({'success': True})
@@ -638,11 +899,7 @@ def delete_media(media_id):
 @requires_auth
 def manage_folders():
     """Create or list folders"""
-    session_id = session.get('session_id')
-    if not session_id or session_id not in active_sessions:
-        return jsonify({'error': 'Authentication required'}), 401
-    
-    vault_type = active_sessions[session_id]['vault_type']
+    vault_type = g.vault_type
     
     if request.method == 'POST':
         data = request.get_json()
@@ -660,17 +917,15 @@ def manage_folders():
     
     else:
         folders = vault_manager.get_folders(vault_type)
-        return jsonify({'folders': folders})
+        return json_response({'folders': folders})
 
 @app.route('/api/settings', methods=['GET', 'PUT'])
 @requires_auth
 def manage_settings():
     """Get or update settings"""
-    session_id = session.get('session_id')
-    if not session_id or session_id not in active_sessions:
-        return jsonify({'error': 'Authentication required'}), 401
+    session_id = g.session_id
     
-    vault_type = active_sessions[session_id]['vault_type']
+    vault_type = g.vault_type
     
     if vault_type != 'real':
         return jsonify({'error': 'Access denied'}), 403
@@ -691,10 +946,8 @@ def manage_settings():
         settings = vault_manager.get_settings()
         
         # Add fingerprint status to settings
-        session_id = session.get('session_id')
-        if session_id and session_id in active_sessions:
-            user_id = active_sessions[session_id].get('user_id', session_id)
-            settings['fingerprint_enabled'] = webauthn_manager.is_fingerprint_enabled(user_id)
+        user_id = g.session_data.get('user_id', session_id)
+        settings['fingerprint_enabled'] = webauthn_manager.is_fingerprint_enabled(user_id)
         
         return jsonify(settings)
 
@@ -702,11 +955,7 @@ def manage_settings():
 @requires_auth
 def update_fingerprint_setting():
     """Update fingerprint setting preference"""
-    session_id = session.get('session_id')
-    if not session_id or session_id not in active_sessions:
-        return jsonify({'error': 'Authentication required'}), 401
-    
-    vault_type = active_sessions[session_id]['vault_type']
+    vault_type = g.vault_type
     
     if vault_type != 'real':
         return jsonify({'error': 'Access denied'}), 403
@@ -725,11 +974,7 @@ def update_fingerprint_setting():
 @requires_auth
 def change_pin():
     """Change PIN"""
-    session_id = session.get('session_id')
-    if not session_id or session_id not in active_sessions:
-        return jsonify({'error': 'Authentication required'}), 401
-    
-    vault_type = active_sessions[session_id]['vault_type']
+    vault_type = g.vault_type
     
     if vault_type != 'real':
         return jsonify({'error': 'Access denied'}), 403
@@ -743,16 +988,9 @@ def change_pin():
         return jsonify({'error': 'Current PIN is incorrect'}), 401
     
     # Validate new PIN
-    if not new_pin or len(new_pin) != 6 or not new_pin.isdigit():
-        return jsonify({'error': 'PIN must be 6 digits'}), 400
-    
-    # Check for simple patterns
-    if len(set(new_pin)) == 1:
-        return jsonify({'error': 'PIN is too simple'}), 400
-    
-    if new_pin in ['123456', '654321', '000000', '111111', '222222', '333333', 
-                   '444444', '555555', '666666', '777777', '888888', '999999']:
-        return jsonify({'error': 'PIN is too common'}), 400
+    error = _validate_pin(new_pin)
+    if error:
+        return jsonify({'error': error}), 400
     
     if vault_manager.update_pin(vault_type, new_pin):
         # Log out all sessions
@@ -770,17 +1008,13 @@ def change_pin():
 @requires_auth
 def get_logs():
     """Get security logs (real vault only)"""
-    session_id = session.get('session_id')
-    if not session_id or session_id not in active_sessions:
-        return jsonify({'error': 'Authentication required'}), 401
-    
-    vault_type = active_sessions[session_id]['vault_type']
+    vault_type = g.vault_type
     
     if vault_type != 'real':
         return jsonify({'error': 'Access denied'}), 403
     
     logs = vault_manager.get_security_logs()
-    return jsonify({'logs': logs})
+    return json_response({'logs': logs})
 
 @app.route('/api/lock', methods=['POST'])
 def lock_vault():
@@ -796,10 +1030,6 @@ def lock_vault():
 @requires_auth
 def create_share():
     """Create temporary share link"""
-    session_id = session.get('session_id')
-    if not session_id or session_id not in active_sessions:
-        return jsonify({'error': 'Authentication required'}), 401
-    
     data = request.get_json()
     media_id = data.get('media_id')
     expiry_hours = data.get('expiry_hours', 24)
@@ -809,8 +1039,7 @@ def create_share():
     
     share_token = vault_manager.create_share_link(
         media_id,
-        expiry_hours,
-        session_id
+        expiry_hours=expiry_hours
     )
     
     if not share_token:
@@ -831,6 +1060,15 @@ def access_share(token):
     if not media_data:
         return jsonify({'error': 'Share expired or invalid'}), 404
     
+    prefix = app.config['X_ACCEL_REDIRECT_PREFIX']
+    if prefix:
+        # Let nginx send the stored bytes instead of streaming them through Python
+        return Response(headers={
+            'X-Accel-Redirect': prefix + media_data['path'].lstrip('/'),
+            'Content-Type': media_data['mimetype'],
+            'Content-Disposition': f'attachment; filename="{media_data["filename"]}"'
+        })
+    
     try:
         # Send the file
         return send_file(
@@ -840,99 +1078,176 @@ def access_share(token):
             download_name=media_data['filename']
         )
     except Exception as e:
-        print(f"Share access error: {e}")
+        app.logger.error("Share access error: %s", e)
         return jsonify({'error': 'Failed to access shared media'}), 500
 
+def json_response(obj, status=200):
+    """Serialize obj straight into a JSON Response, bypassing jsonify()"""
+    if ORJSON_AVAILABLE:
+        body = orjson.dumps(obj)
+    else:
+        body = json.dumps(obj, separators=(',', ':'))
+    return Response(body, status=status, mimetype='application/json')
+
+def send_precompressed(directory, filename, mimetype):
+    """Serve a static file, from its gzipped copy when the client accepts it"""
+    if 'gzip' in request.accept_encodings:
+        gz_path = ensure_gzip_copy(os.path.join(directory, filename))
+        if gz_path:
+            response = send_from_directory(directory, os.path.basename(gz_path),
+                                           mimetype=mimetype)
+            response.headers['Content-Encoding'] = 'gzip'
+            response.vary.add('Accept-Encoding')
+            return response
+    
+    response = send_from_directory(directory, filename, mimetype=mimetype)
+    response.vary.add('Accept-Encoding')
+    return response
+
 @app.route('/service-worker.js')
 def service_worker():
     """Serve service worker"""
-    return send_from_directory('static/js', 'service-worker.js')
+    return send_precompressed('static/js', 'service-worker.js', 'application/javascript')
 
 @app.route('/manifest.json')
 def manifest():
     """Serve web app manifest"""
-    return send_from_directory('static', 'manifest.json')
+    return send_precompressed('static', 'manifest.json', 'application/json')
 
 @app.route('/gallery')
 @requires_auth
+@vault_routed('gallery.html')
 def gallery():
     """Media gallery page"""
-    session_data = active_sessions.get(session.get('session_id'))
-    if not session_data:
-        return redirect('/')
-    
-    vault_type = session_data['vault_type']
-    if vault_type == 'fake':
-        return render_template('fake_vault.html')
-    
-    return render_template('gallery.html')
 
 @app.route('/settings')
 @requires_auth
+@vault_routed('settings.html')
 def settings():
     """Settings page"""
-    session_data = active_sessions.get(session.get('session_id'))
-    if not session_data:
-        return redirect('/')
-    
-    vault_type = session_data['vault_type']
-    if vault_type == 'fake':
-        return render_template('fake_vault.html')
-    
-    return render_template('settings.html')
+
+# Cleanup runs off the request thread, one run at a time. Requests made
+# while a run is in progress share it; each session keeps its latest run
+# for /status
+_cleanup_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cleanup')
+_cleanup_lock = threading.Lock()
+_cleanup_current = None
+_cleanup_jobs = {}
+
+def _run_cleanup():
+    """Clean expired shares, then the recycle bin"""
+    return {
+        'shares_deleted': vault_manager.cleanup_expired_shares(),
+        'recycle_deleted': vault_manager.cleanup_recycle_bin()
+    }
+
+# Expired shares and recycle-bin items are also swept periodically in
+# small batches, so on-demand cleanup never faces a large backlog
+SHARE_SWEEP_SECONDS = 5 * 60
+RECYCLE_SWEEP_SECONDS = 30 * 60
+SWEEP_BATCH_SIZE = 100
+_maintenance_stop = threading.Event()
+
+def _sweep_in_batches(cleanup_batch):
+    """Call cleanup_batch(limit) until a batch comes back short"""
+    while not _maintenance_stop.is_set():
+        if cleanup_batch(SWEEP_BATCH_SIZE) < SWEEP_BATCH_SIZE:
+            break
+
+def _maintenance_loop():
+    """Background thread running the periodic sweeps"""
+    next_share_sweep = next_recycle_sweep = time.monotonic()
+    
+    while not _maintenance_stop.is_set():
+        now = time.monotonic()
+        try:
+            if now >= next_share_sweep:
+                _sweep_in_batches(vault_manager.cleanup_expired_shares)
+                webauthn_manager.cleanup_expired_challenges()
+                next_share_sweep = now + SHARE_SWEEP_SECONDS
+            if now >= next_recycle_sweep:
+                _sweep_in_batches(vault_manager.cleanup_recycle_bin)
+                next_recycle_sweep = now + RECYCLE_SWEEP_SECONDS
+        except sqlite3.Error as e:
+            # Tables don't exist until the vault is set up; retry next tick
+            app.logger.debug("Maintenance sweep skipped: %s", e)
+            next_share_sweep = now + SHARE_SWEEP_SECONDS
+            next_recycle_sweep = now + SHARE_SWEEP_SECONDS
+        
+        _maintenance_stop.wait(max(0.0, min(next_share_sweep, next_recycle_sweep) - time.monotonic()))
+
+_maintenance_thread = threading.Thread(target=_maintenance_loop, name='maintenance', daemon=True)
+_maintenance_thread.start()
+atexit.register(_maintenance_stop.set)
 
 @app.route('/api/cleanup', methods=['POST'])
 @requires_auth
 def cleanup():
-    """Clean up expired data"""
-    session_id = session.get('session_id')
-    if not session_id or session_id not in active_sessions:
-        return jsonify({'error': 'Authentication required'}), 401
-    
-    vault_type = active_sessions[session_id]['vault_type']
+    """Schedule cleanup of expired data"""
+    global _cleanup_current
+    vault_type = g.vault_type
     
     if vault_type != 'real':
-        return jsonify({'error': 'Access denied'}), 403
+        return json_response({'error': 'Access denied'}, 403)
     
-    # Clean expired shares
-    shares_deleted = vault_manager.cleanup_expired_shares()
+    with _cleanup_lock:
+        if _cleanup_current is None or _cleanup_current.done():
+            _cleanup_current = _cleanup_executor.submit(_run_cleanup)
+        
+        # Forget finished runs of other sessions
+        for session_id in [sid for sid, job in _cleanup_jobs.items() if job.done()]:
+            del _cleanup_jobs[session_id]
+        _cleanup_jobs[g.session_id] = _cleanup_current
     
-    # Clean recycle bin
-    recycle_deleted = vault_manager.cleanup_recycle_bin()
+    return json_response({'success': True, 'status': 'scheduled'})
+
+@app.route('/api/cleanup/status')
+@requires_auth
+def cleanup_status():
+    """Report on this session's last cleanup run"""
+    if g.vault_type != 'real':
+        return json_response({'error': 'Access denied'}, 403)
     
-    return jsonify({
-        'success': True,
-        'shares_deleted': shares_deleted,
-        'recycle_deleted': recycle_deleted
-    })
+    job = _cleanup_jobs.get(g.session_id)
+    if job is None:
+        return json_response({'status': 'none'})
+    
+    if not job.done():
+        return json_response({'status': 'running'})
+    
+    try:
+        return json_response({'status': 'done', **job.result()})
+    except Exception as e:
+        app.logger.error("Cleanup error: %s", e)
+        return json_response({'status': 'failed', 'error': 'Cleanup failed'}, 500)
 
 @app.route('/api/storage/stats')
 @requires_auth
 def storage_stats():
     """Get storage statistics"""
-    session_id = session.get('session_id')
-    if not session_id or session_id not in active_sessions:
-        return jsonify({'error': 'Authentication required'}), 401
-    
-    vault_type = active_sessions[session_id]['vault_type']
+    vault_type = g.vault_type
     stats = vault_manager.get_storage_stats(vault_type)
-    return jsonify(stats)
+    return json_response(stats)
+
+# Parts of the health payload that never change while the app runs
+_HEALTH_STATIC = {
+    'status': 'healthy',
+    'version': '1.0.0'
+}
 
 @app.route('/health')
 def health():
-    """Health check endpoint"""
-    return jsonify({
-        'status': 'healthy',
+    """Health check endpoint (no database access once the vault is set up)"""
+    return json_response({
+        **_HEALTH_STATIC,
+        # Doesn't import webauthn, so probes stay cheap; reflects a failed
+        # import once a fingerprint request has tried it
+        'webauthn_available': webauthn_available(),
         'timestamp': datetime.now().isoformat(),
-        'version': '1.0.0',
-        'first_time': is_first_time(),
-        'webauthn_available': webauthn_manager.WEBAUTHN_AVAILABLE if hasattr(webauthn_manager, 'WEBAUTHN_AVAILABLE') else False
+        'first_time': is_first_time()
     })
 
-@app.route('/offline')
-def offline():
-    """Offline page for PWA"""
-    return '''
+_OFFLINE_HTML = '''
     <!DOCTYPE html>
     <html>
     <head>
@@ -981,53 +1296,105 @@ def offline():
     </html>
     '''
 
-@app.route('/static/<path:path>')
-def serve_static(path):
-    """Serve static files"""
-    return send_from_directory('static', path)
+@app.route('/offline')
+def offline():
+    """Offline page for PWA"""
+    return _OFFLINE_HTML
 
 # Error handlers
+# Bodies are serialized once; a fresh Response is still built per error,
+# since after_request hooks and the session add headers (Set-Cookie) to it
+_ERROR_BODIES = {
+    404: b'{"error":"Not found"}',
+    500: b'{"error":"Server error"}',
+    413: b'{"error":"File too large (max 100MB)"}',
+    401: b'{"error":"Authentication required"}',
+    403: b'{"error":"Access denied"}'
+}
+
+def _error_response(status):
+    return Response(_ERROR_BODIES[status], status=status, mimetype='application/json')
+
 @app.errorhandler(404)
 def not_found(error):
-    return jsonify({'error': 'Not found'}), 404
+    return _error_response(404)
 
 @app.errorhandler(500)
 def server_error(error):
-    print(f"Server error: {error}")
-    return jsonify({'error': 'Server error'}), 500
+    app.logger.error("Server error: %s", error)
+    return _error_response(500)
 
 @app.errorhandler(413)
 def too_large(error):
-    return jsonify({'error': 'File too large (max 100MB)'}), 413
+    return _error_response(413)
 
 @app.errorhandler(401)
 def unauthorized(error):
-    return jsonify({'error': 'Authentication required'}), 401
+    return _error_response(401)
 
 @app.errorhandler(403)
 def forbidden(error):
-    return jsonify({'error': 'Access denied'}), 403
+    return _error_response(403)
 
 @app.before_request
 def check_maintenance():
     """Check for maintenance or other pre-request conditions"""
     # You can add maintenance mode checks here
-    pass
+    active_sessions.sweep()
+
+# Headers added to every response, built once at startup
+_WEBAUTHN_ORIGIN = app.config['WEBAUTHN_ORIGIN']
+_SECURITY_HEADERS = {
+    'X-Content-Type-Options': 'nosniff',
+    'X-Frame-Options': 'DENY',
+    'X-XSS-Protection': '1; mode=block',
+    'Referrer-Policy': 'strict-origin-when-cross-origin',
+    # Templates use inline scripts/styles and GSAP from cdnjs; media is
+    # shown through blob: URLs
+    'Content-Security-Policy': (
+        "default-src 'self'; "
+        "script-src 'self' 'unsafe-inline' https://cdnjs.cloudflare.com; "
+        "style-src 'self' 'unsafe-inline'; "
+        "img-src 'self' data: blob:; "
+        "media-src 'self' blob:; "
+        "frame-ancestors 'none'"
+    )
+}
+
+# Only meaningful (and only honoured by browsers) over HTTPS
+_HSTS_HEADER = 'max-age=31536000; includeSubDomains'
+
+# Add WebAuthn headers (only when an origin is configured)
+if _WEBAUTHN_ORIGIN:
+    _SECURITY_HEADERS['Access-Control-Allow-Origin'] = _WEBAUTHN_ORIGIN
+    _SECURITY_HEADERS['Access-Control-Allow-Credentials'] = 'true'
 
 @app.after_request
 def add_security_headers(response):
     """Add security headers to all responses"""
-    response.headers['X-Content-Type-Options'] = 'nosniff'
-    response.headers['X-Frame-Options'] = 'DENY'
-    response.headers['X-XSS-Protection'] = '1; mode=block'
-    response.headers['Referrer-Policy'] = 'strict-origin-when-cross-origin'
-    
-    # Add WebAuthn headers
-    response.headers['Access-Control-Allow-Origin'] = app.config['WEBAUTHN_ORIGIN']
-    response.headers['Access-Control-Allow-Credentials'] = 'true'
-    
+    response.headers.update(_SECURITY_HEADERS)
+    if request.is_secure:
+        response.headers['Strict-Transport-Security'] = _HSTS_HEADER
     return response
 
+@lru_cache(maxsize=1)
+def get_local_ip():
+    """LAN address of this device, or None (looked up once)"""
+    # Connecting a UDP socket sends nothing; it only picks the outgoing interface
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            s.settimeout(0.2)
+            s.connect(("8.8.8.8", 80))
+            return s.getsockname()[0]
+    except OSError:
+        pass
+    
+    try:
+        local_ip = socket.gethostbyname(socket.gethostname())
+    except OSError:
+        return None
+    return None if local_ip.startswith('127.') else local_ip
+
 def print_startup_info():
     """Print startup information"""
     print("\n" + "="*60)
@@ -1043,26 +1410,20 @@ def print_startup_info():
         print("   Using existing PIN for authentication")
     
     # Check fingerprint availability
-    if hasattr(webauthn_manager, 'WEBAUTHN_AVAILABLE'):
-        if webauthn_manager.WEBAUTHN_AVAILABLE:
-            print("✅ Fingerprint authentication: AVAILABLE")
-        else:
-            print("⚠️  Fingerprint authentication: NOT AVAILABLE")
-            print("   Install: pip install webauthn")
+    if WEBAUTHN_AVAILABLE:
+        print("✅ Fingerprint authentication: AVAILABLE")
+    else:
+        print("⚠️  Fingerprint authentication: NOT AVAILABLE")
+        print("   Install: pip install webauthn")
     
     # Get local IP address
-    try:
-        import socket
-        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        s.connect(("8.8.8.8", 80))
-        local_ip = s.getsockname()[0]
-        s.close()
-        
+    local_ip = get_local_ip()
+    if local_ip:
         print("\n🌐 ACCESS URLs:")
         print(f"   Termux browser: http://localhost:5000")
         print(f"   Phone browser:  http://{local_ip}:5000")
         print(f"   On same WiFi:   http://{local_ip}:5000")
-    except:
+    else:
         print("\n🌐 ACCESS URL:")
         print("   http://localhost:5000")
     
@@ -1076,13 +1437,18 @@ if __name__ == '__main__':
     
     # Run without SSL for Termux
     try:
-        app.run(
-            host='0.0.0.0', 
-            port=5000, 
-            debug=True, 
-            threaded=True,
-            use_reloader=False  # Disable reloader for Termux
-        )
+        if WAITRESS_AVAILABLE and not os.environ.get('FLASK_DEBUG'):
+            # Sessions, tokens and uploads live in this process, so scale
+            # with threads rather than extra worker processes
+            serve(app, host='0.0.0.0', port=5000, threads=8, connection_limit=200)
+        else:
+            app.run(
+                host='0.0.0.0', 
+                port=5000, 
+                debug=True, 
+                threaded=True,
+                use_reloader=False  # Disable reloader for Termux
+            )
     except KeyboardInterrupt:
         print("\n👋 Shutting down VantaVault...")
         sys.exit(0)
@@ -194,6 +194,12 @@ server {{
         proxy_set_header Connection "upgrade";
     }}
     
+    # Stored files handed back by the app via X-Accel-Redirect
+    location /internal/ {{
+        internal;
+        alias /opt/vantavault/;
+    }}
+    
     location /static {{
         alias /opt/vantavault/static;
         expires 1y;
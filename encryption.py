@@ -1,156 +1,358 @@
 """
-VantaVault - Pure Python Encryption
-Uses only Python standard library - works anywhere
+VantaVault - Encryption
+AES-256-GCM via the cryptography package (hardware AES where available)
 """
 import os
 import base64
 import hashlib
 import secrets
-import hmac
-import struct
 import time
-from typing import Union, Tuple
-import zlib
+from typing import Tuple
+import mmap
+import threading
+import ctypes
+import ctypes.util
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+try:
+    import pyvips
+    PYVIPS_AVAILABLE = True
+except (ImportError, OSError):  # OSError: Python binding present, libvips missing
+    PYVIPS_AVAILABLE = False
+
+# Files are encrypted in chunks of this size; on disk (and from
+# encrypt_bytes) data is stored as nonce (12) + GCM tag (16) + raw
+# ciphertext, without base64
+FILE_CHUNK_SIZE = 1024 * 1024
+FILE_HEADER_SIZE = 12 + 16
+
+# scrypt cost for new password hashes (~32 MiB of memory per hash)
+SCRYPT_N = 2 ** 15
+SCRYPT_R = 8
+SCRYPT_P = 1
+SCRYPT_MAXMEM = 64 * 1024 * 1024
+
+# PBKDF2 cost for encryption keys (OWASP 2023 for HMAC-SHA256). Derived
+# keys are cached for a session's lifetime so the cost is paid once per
+# login, not once per operation
+PBKDF2_ITERATIONS = 600000
+KEY_CACHE_TTL = 1800
+KEY_CACHE_SIZE = 1024
+_key_cache = {}
+_key_cache_lock = threading.Lock()
+
+def _pbkdf2_key(password: str, salt: bytes, iterations: int) -> bytes:
+    """PBKDF2-HMAC-SHA256 with a TTL cache
+    
+    Entries are keyed by a SHA-256 of the inputs so the cache never holds
+    the password itself.
+    """
+    password_bytes = password.encode('utf-8')
+    cache_key = hashlib.sha256(b'%d:%d:' % (len(salt), iterations) + salt + password_bytes).digest()
+    now = time.monotonic()
+    
+    with _key_cache_lock:
+        cached = _key_cache.get(cache_key)
+        if cached and cached[1] > now:
+            return cached[0]
+    
+    key = hashlib.pbkdf2_hmac('sha256', password_bytes, salt, iterations, dklen=32)
+    
+    with _key_cache_lock:
+        if len(_key_cache) >= KEY_CACHE_SIZE:
+            for stale in [k for k, (_, expires) in _key_cache.items() if expires <= now]:
+                del _key_cache[stale]
+            if len(_key_cache) >= KEY_CACHE_SIZE:
+                # Still full of live keys: drop the oldest
+                del _key_cache[next(iter(_key_cache))]
+        _key_cache[cache_key] = (key, now + KEY_CACHE_TTL)
+    
+    return key
+
+def _scrypt(password: str, salt: bytes) -> bytes:
+    return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=SCRYPT_N, r=SCRYPT_R,
+                          p=SCRYPT_P, maxmem=SCRYPT_MAXMEM, dklen=32)
+
+def _pillow_thumbnail(image_path: str, thumbnail_path: str, size: Tuple[int, int]):
+    """Pillow thumbnail; run on _thumbnail_pool"""
+    from PIL import Image
+    
+    with Image.open(image_path) as img:
+        # Let JPEG decode at reduced scale instead of full resolution
+        img.draft('RGB', size)
+        
+        # Convert to RGB if necessary
+        if img.mode in ('RGBA', 'LA', 'P'):
+            background = Image.new('RGB', img.size, (0, 0, 0))
+            if img.mode == 'P':
+                img = img.convert('RGBA')
+            background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
+            img = background
+        
+        # Create thumbnail
+        img.thumbnail(size)
+        
+        # Save thumbnail
+        img.save(thumbnail_path, 'JPEG', quality=85)
+    
+    return True
+
+# Pillow thumbnails run on a small thread pool: Pillow releases the GIL
+# while decoding and resizing, and the cap bounds how many full bitmaps are
+# in memory at once. Threads rather than processes, since forking the
+# multi-threaded server can deadlock the children on inherited locks
+THUMBNAIL_WORKERS = 2
+_thumbnail_pool = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS,
+                                     thread_name_prefix='thumbnail')
+
+# Share tokens are cut from a pool of random bytes refilled 64 tokens at a
+# time, so bursts of share creation make one getrandom() call instead of many
+SHARE_TOKEN_BYTES = 32
+_TOKEN_POOL_TOKENS = 64
+_token_pool = bytearray()
+_token_pool_pid = None
+_token_pool_lock = threading.Lock()
+
+def _take_random_bytes(count: int) -> bytes:
+    global _token_pool_pid
+    with _token_pool_lock:
+        # A forked child must never reuse bytes its parent may also hand out
+        if _token_pool_pid != os.getpid():
+            _token_pool.clear()
+            _token_pool_pid = os.getpid()
+        if len(_token_pool) < count:
+            _token_pool.extend(os.urandom(count * _TOKEN_POOL_TOKENS))
+        
+        chunk = bytes(_token_pool[-count:])
+        del _token_pool[-count:]
+    return chunk
+
+# fallocate(2) mode for deallocating a byte range in place
+_FALLOC_FL_KEEP_SIZE = 0x01
+_FALLOC_FL_PUNCH_HOLE = 0x02
+
+@lru_cache(maxsize=None)
+def _device_is_solid_state(st_dev: int) -> bool:
+    """True if the block device is non-rotational (Linux only; cached per device)"""
+    try:
+        device = os.path.realpath(f'/sys/dev/block/{os.major(st_dev)}:{os.minor(st_dev)}')
+        # Partitions keep their queue settings on the parent disk
+        for candidate in (device, os.path.dirname(device)):
+            rotational = os.path.join(candidate, 'queue', 'rotational')
+            if os.path.exists(rotational):
+                with open(rotational) as f:
+                    return f.read().strip() == '0'
+    except (OSError, AttributeError):
+        pass
+    return False
+
+def _is_solid_state(path: str) -> bool:
+    """True if path lives on a non-rotational block device"""
+    try:
+        return _device_is_solid_state(os.stat(path).st_dev)
+    except OSError:
+        return False
+
+@lru_cache(maxsize=None)
+def _libc_fallocate():
+    """libc's fallocate, or None; looked up once (find_library runs ldconfig)"""
+    libc_name = ctypes.util.find_library('c')
+    if not libc_name:
+        return None
+    
+    try:
+        fallocate = ctypes.CDLL(libc_name, use_errno=True).fallocate
+    except (OSError, AttributeError):
+        return None
+    fallocate.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_longlong, ctypes.c_longlong]
+    return fallocate
+
+def _punch_hole(path: str) -> bool:
+    """Deallocate all of a file's blocks so the SSD can TRIM them"""
+    fallocate = _libc_fallocate()
+    if fallocate is None:
+        return False
+    
+    fd = os.open(path, os.O_RDWR)
+    try:
+        size = os.fstat(fd).st_size
+        if fallocate(fd, _FALLOC_FL_PUNCH_HOLE | _FALLOC_FL_KEEP_SIZE, 0, size) != 0:
+            return False
+        os.fsync(fd)
+        return True
+    finally:
+        os.close(fd)
 
 class EncryptionManager:
     def __init__(self):
         self.salt = b'vantavault_salt_v1_'
     
-    def derive_key(self, password: str, salt: bytes = None, iterations: int = 100000) -> bytes:
-        """Derive encryption key from password using PBKDF2"""
+    def derive_key_from_password(self, password: str, salt: bytes = None,
+                                 iterations: int = PBKDF2_ITERATIONS) -> bytes:
+        """Derive encryption key from password using PBKDF2 (cached per password/salt)
+        
+        This is the slow, brute-force resistant step; do it once per login
+        and derive per-purpose keys from its result with
+        derive_key_from_session_secret().
+        """
         if salt is None:
             salt = self.salt
         
-        password_bytes = password.encode('utf-8')
-        key = hashlib.pbkdf2_hmac(
-            'sha256',
-            password_bytes,
-            salt,
-            iterations,
-            dklen=32  # 256-bit key
-        )
-        return key
+        return _pbkdf2_key(password, bytes(salt), iterations)
     
-    def encrypt_data(self, data: bytes, password: str) -> bytes:
-        """Encrypt data using password-derived key"""
-        # Generate random IV
-        iv = secrets.token_bytes(16)
+    # Kept for existing callers
+    derive_key = derive_key_from_password
+    
+    def derive_key_from_session_secret(self, session_key: bytes, purpose: bytes, salt: bytes = b'') -> bytes:
+        """Derive a 32-byte subkey from an already-stretched key with one BLAKE2b call
         
-        # Derive key from password
-        key = self.derive_key(password)
+        session_key must be high-entropy (e.g. derive_key_from_password output);
+        purpose separates keys for different files or uses, salt is up to 16 bytes.
+        """
+        return hashlib.blake2b(
+            purpose,
+            key=session_key,
+            salt=salt,
+            person=b'vantavault',
+            digest_size=32
+        ).digest()
+    
+    def encrypt_bytes(self, data: bytes, password: str) -> bytes:
+        """Encrypt data with AES-256-GCM; returns nonce + tag + ciphertext
         
-        # Use HMAC for authenticated encryption
-        h = hmac.new(key, digestmod='sha256')
-        h.update(iv)
-        h.update(data)
+        This is the same layout encrypt_file writes, so either side can
+        read the other's output.
+        """
+        nonce = secrets.token_bytes(12)
+        key = self.derive_key(password)
+        encryptor = Cipher(algorithms.AES(key), modes.GCM(nonce)).encryptor()
+        ciphertext = encryptor.update(data) + encryptor.finalize()
+        return nonce + encryptor.tag + ciphertext
+    
+    def decrypt_bytes(self, data: bytes, password: str) -> bytes:
+        """Decrypt the output of encrypt_bytes"""
+        if len(data) < FILE_HEADER_SIZE:
+            raise ValueError("Invalid encrypted data")
         
-        # Create ciphertext (simple XOR for demo - in production use proper encryption)
-        # This is simplified - for real use, implement proper AES or use a library
-        encrypted = self._simple_xor(data, key[:16])
+        key = self.derive_key(password)
+        decryptor = Cipher(algorithms.AES(key), modes.GCM(data[:12], data[12:FILE_HEADER_SIZE])).decryptor()
         
-        # Return: IV + HMAC + encrypted data
-        result = iv + h.digest()[:16] + encrypted
-        return base64.urlsafe_b64encode(result)
+        try:
+            return decryptor.update(memoryview(data)[FILE_HEADER_SIZE:]) + decryptor.finalize()
+        except InvalidTag:
+            raise ValueError("Decryption failed: authentication failed")
+    
+    def encrypt_data(self, data: bytes, password: str) -> bytes:
+        """Encrypt data for transport (base64 of encrypt_bytes)"""
+        return base64.urlsafe_b64encode(self.encrypt_bytes(data, password))
     
     def decrypt_data(self, encrypted_data: bytes, password: str) -> bytes:
-        """Decrypt data using password-derived key"""
+        """Decrypt the output of encrypt_data"""
         try:
-            # Decode from base64
             data = base64.urlsafe_b64decode(encrypted_data)
-            
-            if len(data) < 32:  # IV (16) + HMAC (16)
-                raise ValueError("Invalid encrypted data")
-            
-            # Extract components
-            iv = data[:16]
-            received_hmac = data[16:32]
-            ciphertext = data[32:]
-            
-            # Derive key from password
-            key = self.derive_key(password)
-            
-            # Verify HMAC
-            h = hmac.new(key, digestmod='sha256')
-            h.update(iv)
-            h.update(ciphertext)
-            expected_hmac = h.digest()[:16]
-            
-            if not hmac.compare_digest(received_hmac, expected_hmac):
-                raise ValueError("HMAC verification failed")
-            
-            # Decrypt
-            decrypted = self._simple_xor(ciphertext, key[:16])
-            return decrypted
-            
         except Exception as e:
             raise ValueError(f"Decryption failed: {e}")
-    
-    def _simple_xor(self, data: bytes, key: bytes) -> bytes:
-        """Simple XOR encryption (for demo - replace with proper crypto in production)"""
-        key_len = len(key)
-        result = bytearray(len(data))
         
-        for i, byte in enumerate(data):
-            result[i] = byte ^ key[i % key_len]
-        
-        return bytes(result)
+        return self.decrypt_bytes(data, password)
     
     def encrypt_file(self, input_path: str, output_path: str, password: str):
-        """Encrypt file and save to output path"""
-        with open(input_path, 'rb') as f:
-            file_data = f.read()
-        
-        encrypted_data = self.encrypt_data(file_data, password)
+        """Encrypt file and save to output path, streaming in chunks"""
+        nonce = secrets.token_bytes(12)
+        key = self.derive_key(password)
+        encryptor = Cipher(algorithms.AES(key), modes.GCM(nonce)).encryptor()
         
-        with open(output_path, 'wb') as f:
-            f.write(encrypted_data)
+        with open(input_path, 'rb') as fin, open(output_path, 'wb') as fout:
+            # Tag isn't known until the end; reserve its place in the header
+            fout.write(nonce + bytes(16))
+            
+            self._stream_cipher(encryptor, fin, fout)
+            fout.write(encryptor.finalize())
+            fout.seek(12)
+            fout.write(encryptor.tag)
     
     def decrypt_file(self, input_path: str, output_path: str, password: str):
-        """Decrypt file and save to output path"""
-        with open(input_path, 'rb') as f:
-            encrypted_data = f.read()
+        """Decrypt file and save to output path, streaming in chunks"""
+        key = self.derive_key(password)
+        
+        with open(input_path, 'rb') as fin:
+            header = fin.read(FILE_HEADER_SIZE)
+            if len(header) < FILE_HEADER_SIZE:
+                raise ValueError("Invalid encrypted file")
+            
+            decryptor = Cipher(algorithms.AES(key), modes.GCM(header[:12], header[12:])).decryptor()
+            
+            try:
+                with open(output_path, 'wb') as fout:
+                    self._stream_cipher(decryptor, fin, fout, offset=FILE_HEADER_SIZE)
+                    fout.write(decryptor.finalize())
+            except InvalidTag:
+                # Don't leave unauthenticated plaintext behind
+                os.remove(output_path)
+                raise ValueError("Decryption failed: authentication failed")
+    
+    def _stream_cipher(self, context, fin, fout, offset: int = 0):
+        """Feed fin (from offset) through a cipher context into fout
+        
+        The input is memory-mapped and passed as zero-copy slices, and the
+        output goes through one reused buffer, so no per-chunk copies are made.
+        """
+        size = os.fstat(fin.fileno()).st_size
+        if size <= offset:
+            return
         
-        decrypted_data = self.decrypt_data(encrypted_data, password)
+        out = bytearray(FILE_CHUNK_SIZE + 15)  # update_into needs block_size - 1 spare
+        out_view = memoryview(out)
         
-        with open(output_path, 'wb') as f:
-            f.write(decrypted_data)
+        with mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            with memoryview(mm) as data:
+                for start in range(offset, size, FILE_CHUNK_SIZE):
+                    with data[start:start + FILE_CHUNK_SIZE] as chunk:
+                        written = context.update_into(chunk, out)
+                    fout.write(out_view[:written])
     
     def secure_delete(self, file_path: str, passes: int = 3):
         """Securely delete file by overwriting"""
         if not os.path.exists(file_path):
             return
         
+        # On SSDs wear levelling means overwrites may land on different
+        # cells anyway; release the blocks for TRIM instead
+        if _is_solid_state(file_path) and _punch_hole(file_path):
+            os.remove(file_path)
+            return
+        
         file_size = os.path.getsize(file_path)
         
-        for i in range(passes):
-            # Overwrite with random data
-            with open(file_path, 'wb') as f:
-                f.write(secrets.token_bytes(file_size))
+        # Overwrite in place ('r+b', not 'wb', which would truncate and let
+        # the filesystem hand out fresh blocks) one chunk at a time
+        with open(file_path, 'r+b') as f:
+            for i in range(passes):
+                f.seek(0)
+                for offset in range(0, file_size, FILE_CHUNK_SIZE):
+                    f.write(os.urandom(min(FILE_CHUNK_SIZE, file_size - offset)))
+                
+                f.flush()
+                os.fsync(f.fileno())
         
         # Delete file
         os.remove(file_path)
     
     def generate_thumbnail(self, image_path: str, thumbnail_path: str, size: Tuple[int, int] = (200, 200)):
-        """Generate thumbnail (requires Pillow)"""
+        """Generate thumbnail (libvips if available, otherwise Pillow)"""
         try:
-            from PIL import Image
-            
-            with Image.open(image_path) as img:
-                # Convert to RGB if necessary
-                if img.mode in ('RGBA', 'LA', 'P'):
-                    background = Image.new('RGB', img.size, (0, 0, 0))
-                    if img.mode == 'P':
-                        img = img.convert('RGBA')
-                    background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                    img = background
-                
-                # Create thumbnail
-                img.thumbnail(size)
-                
-                # Save thumbnail
-                img.save(thumbnail_path, 'JPEG', quality=85)
-                
+            if PYVIPS_AVAILABLE:
+                # Decodes on demand instead of loading the full bitmap
+                thumb = pyvips.Image.thumbnail(image_path, size[0], height=size[1])
+                if thumb.hasalpha():
+                    thumb = thumb.flatten(background=[0, 0, 0])
+                thumb.write_to_file(thumbnail_path, Q=85)
                 return True
+            
+            return _thumbnail_pool.submit(_pillow_thumbnail, image_path, thumbnail_path, size).result()
                 
         except ImportError:
             print("Pillow not installed. Using simple thumbnail method.")
@@ -167,31 +369,31 @@ class EncryptionManager:
             return False
     
     def hash_password(self, password: str) -> str:
-        """Create secure password hash"""
+        """Create secure password hash ('scrypt$' + base64(salt + key))"""
         salt = secrets.token_bytes(16)
-        key = hashlib.pbkdf2_hmac(
-            'sha256',
-            password.encode('utf-8'),
-            salt,
-            100000,
-            dklen=32
-        )
-        return base64.urlsafe_b64encode(salt + key).decode('utf-8')
+        key = _scrypt(password, salt)
+        return 'scrypt$' + base64.urlsafe_b64encode(salt + key).decode('utf-8')
     
     def verify_password(self, password_hash: str, password: str) -> bool:
-        """Verify password against hash"""
+        """Verify password against hash (scrypt, or legacy untagged PBKDF2)"""
         try:
-            data = base64.urlsafe_b64decode(password_hash)
+            algorithm, _, encoded = password_hash.rpartition('$')
+            data = base64.urlsafe_b64decode(encoded)
             salt = data[:16]
             stored_key = data[16:]
             
-            key = hashlib.pbkdf2_hmac(
-                'sha256',
-                password.encode('utf-8'),
-                salt,
-                100000,
-                dklen=32
-            )
+            if algorithm == 'scrypt':
+                key = _scrypt(password, salt)
+            elif algorithm in ('', 'pbkdf2'):
+                key = hashlib.pbkdf2_hmac(
+                    'sha256',
+                    password.encode('utf-8'),
+                    salt,
+                    100000,
+                    dklen=32
+                )
+            else:
+                return False
             
             return secrets.compare_digest(stored_key, key)
         except Exception:
@@ -199,7 +401,8 @@ class EncryptionManager:
     
     def generate_share_token(self) -> str:
         """Generate secure share token"""
-        return secrets.token_urlsafe(32)
+        token = _take_random_bytes(SHARE_TOKEN_BYTES)
+        return base64.urlsafe_b64encode(token).rstrip(b'=').decode('ascii')
     
     def generate_pin_hash(self, pin: str) -> str:
         """Create secure PIN hash"""
@@ -3,38 +3,81 @@ VantaVault - WebAuthn Fingerprint Authentication
 Fixed Version
 """
 import json
+import importlib.util
 import base64
 import secrets
 from datetime import datetime
 import sqlite3
+import threading
+import time
 from flask import Flask, request, jsonify, session
 
+from vault import WEBAUTHN_CREDENTIALS_SCHEMA
+
 try:
-    from webauthn import (
-        generate_registration_options,
-        verify_registration_response,
-        generate_authentication_options,
-        verify_authentication_response,
-        options_to_json,
-        base64url_to_bytes,
-        bytes_to_base64url
-    )
-    from webauthn.helpers import (
-        cose,
-        json_loads_base64url_to_bytes,
-        json_dumps_bytes_to_base64url,
-        structs
-    )
-    from webauthn.helpers.structs import (
-        AuthenticatorSelectionCriteria,
-        UserVerificationRequirement,
-        RegistrationCredential,
-        AuthenticationCredential,
-        PublicKeyCredentialDescriptor
-    )
-    WEBAUTHN_AVAILABLE = True
+    import orjson
+    ORJSON_AVAILABLE = True
 except ImportError:
-    WEBAUTHN_AVAILABLE = False
+    ORJSON_AVAILABLE = False
+
+# How long a registration/authentication challenge may be answered
+CHALLENGE_TTL_SECONDS = 300
+
+# The webauthn package (and the pydantic models it builds) is only
+# imported on the first fingerprint request; until then, availability
+# is judged by whether the package is installed at all
+WEBAUTHN_AVAILABLE = importlib.util.find_spec('webauthn') is not None
+_webauthn_loaded = False
+
+def _load_webauthn():
+    """Import the webauthn names on first use; returns WEBAUTHN_AVAILABLE"""
+    global WEBAUTHN_AVAILABLE, _webauthn_loaded
+    global generate_registration_options, verify_registration_response
+    global generate_authentication_options, verify_authentication_response
+    global options_to_json, AuthenticatorSelectionCriteria, UserVerificationRequirement
+    global RegistrationCredential, AuthenticationCredential, PublicKeyCredentialDescriptor
+    
+    if _webauthn_loaded or not WEBAUTHN_AVAILABLE:
+        return WEBAUTHN_AVAILABLE
+    
+    try:
+        from webauthn import (
+            generate_registration_options,
+            verify_registration_response,
+            generate_authentication_options,
+            verify_authentication_response,
+            options_to_json
+        )
+        from webauthn.helpers.structs import (
+            AuthenticatorSelectionCriteria,
+            UserVerificationRequirement,
+            RegistrationCredential,
+            AuthenticationCredential,
+            PublicKeyCredentialDescriptor
+        )
+        _webauthn_loaded = True
+    except ImportError:
+        WEBAUTHN_AVAILABLE = False
+    
+    return WEBAUTHN_AVAILABLE
+
+def webauthn_available():
+    """WEBAUTHN_AVAILABLE as it stands now, without forcing the import: the
+    installed check until the first fingerprint request, then the real result"""
+    return WEBAUTHN_AVAILABLE
+
+def _options_to_dict(options):
+    """Convert WebAuthn options to a JSON-ready dict (base64url bytes)"""
+    if ORJSON_AVAILABLE:
+        return orjson.loads(options_to_json(options))
+    return json.loads(options_to_json(options))
+
+def _parse_credential(model, request_data):
+    """Build a credential model straight from the raw JSON request body"""
+    if not isinstance(request_data, (str, bytes)):
+        # Already-decoded dicts still work, at the cost of a re-encode
+        request_data = json.dumps(request_data)
+    return model.parse_raw(request_data)
 
 class WebAuthnManager:
     def __init__(self, app):
@@ -43,10 +86,54 @@ class WebAuthnManager:
         self.rp_id = app.config.get('WEBAUTHN_RP_ID', 'localhost')
         self.rp_name = app.config.get('WEBAUTHN_RP_NAME', 'VantaVault')
         self.origin = app.config.get('WEBAUTHN_ORIGIN', 'http://localhost:5000')
+        
+        # One connection per thread, reused across requests; sqlite3's own
+        # statement cache then keeps the queries below compiled
+        self._local = threading.local()
+        
+        # user_id -> (enabled, checked_at); credentials change rarely, so
+        # the lookup is reused for up to a minute
+        self._fp_cache = {}
+        self._fp_cache_ttl = 60.0
+        self._create_tables()
+    
+    def _db(self):
+        """Get this thread's database connection (WAL, autocommit)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.app.config['DATABASE'],
+                check_same_thread=False,
+                isolation_level=None
+            )
+            conn.executescript('''
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                PRAGMA cache_size=-16000;
+                PRAGMA busy_timeout=5000;
+                PRAGMA temp_store=MEMORY;
+                PRAGMA mmap_size=268435456;
+            ''')
+            self._local.conn = conn
+        return conn
+    
+    def _create_tables(self):
+        """Create the credential and challenge tables once, at startup"""
+        self._db().executescript(WEBAUTHN_CREDENTIALS_SCHEMA + ''';
+            CREATE INDEX IF NOT EXISTS idx_webauthn_user
+            ON webauthn_credentials(user_id);
+            
+            CREATE TABLE IF NOT EXISTS webauthn_challenges (
+                id INTEGER PRIMARY KEY,
+                user_id TEXT NOT NULL,
+                challenge BLOB NOT NULL,
+                created_at INTEGER NOT NULL
+            );
+        ''')
     
     def register_credential(self, user_id=None):
         """Register new fingerprint credential"""
-        if not WEBAUTHN_AVAILABLE:
+        if not _load_webauthn():
             return {'error': 'WebAuthn not available'}, 501
         
         # Use provided user_id or get from session
@@ -66,22 +153,26 @@ class WebAuthnManager:
             challenge=secrets.token_bytes(32)
         )
         
-        # Store challenge in session
-        session['webauthn_challenge'] = options.challenge
+        # Keep the challenge server-side; the session only carries its id
+        session['webauthn_challenge_id'] = self._store_challenge(user_id, options.challenge)
         session['webauthn_user_id'] = user_id
         
-        return json.loads(options_to_json(options))
+        return _options_to_dict(options)
     
     def verify_registration(self, request_data):
         """Verify registration response"""
-        if not WEBAUTHN_AVAILABLE:
+        if not _load_webauthn():
             return {'success': False, 'error': 'WebAuthn not available'}
         
         try:
+            challenge = self._take_challenge(session.get('webauthn_challenge_id'))
+            if challenge is None:
+                return {'success': False, 'error': 'Challenge expired or already used'}
+            
             # Verify registration
             verification = verify_registration_response(
-                credential=RegistrationCredential.parse_raw(json.dumps(request_data)),
-                expected_challenge=session.get('webauthn_challenge'),
+                credential=_parse_credential(RegistrationCredential, request_data),
+                expected_challenge=challenge,
                 expected_rp_id=self.rp_id,
                 expected_origin=self.origin
             )
@@ -98,7 +189,7 @@ class WebAuthnManager:
             )
             
             # Clear session data
-            session.pop('webauthn_challenge', None)
+            session.pop('webauthn_challenge_id', None)
             session.pop('webauthn_user_id', None)
             
             return {'success': True}
@@ -108,7 +199,7 @@ class WebAuthnManager:
     
     def authenticate(self, user_id=None):
         """Start fingerprint authentication"""
-        if not WEBAUTHN_AVAILABLE:
+        if not _load_webauthn():
             return {'success': False, 'error': 'WebAuthn not available'}
         
         try:
@@ -116,9 +207,10 @@ class WebAuthnManager:
             if not user_id:
                 user_id = session.get('user_id', 'default_user')
             
-            # Get stored credentials
-            credentials = self._get_credentials(user_id)
-            if not credentials:
+            # Only the IDs are needed here; the key and sign count are
+            # read for the one credential the client answers with
+            credential_ids = self._get_credential_ids(user_id)
+            if not credential_ids:
                 return {'success': False, 'error': 'No credentials registered'}
             
             # Generate authentication options
@@ -127,20 +219,21 @@ class WebAuthnManager:
                 challenge=secrets.token_bytes(32),
                 allow_credentials=[
                     PublicKeyCredentialDescriptor(
-                        id=cred['credential_id'],
+                        id=credential_id,
                         type='public-key'
-                    ) for cred in credentials
+                    ) for credential_id in credential_ids
                 ],
                 user_verification=UserVerificationRequirement.PREFERRED
             )
             
-            # Store challenge in session
-            session['webauthn_challenge'] = options.challenge
+            # Keep the challenge server-side; the session only carries its id
+            session['webauthn_challenge_id'] = self._store_challenge(user_id, options.challenge)
             session['webauthn_user_id'] = user_id
+            session['webauthn_cred_ids'] = credential_ids
             
             return {
                 'success': True,
-                'options': json.loads(options_to_json(options))
+                'options': _options_to_dict(options)
             }
             
         except Exception as e:
@@ -148,7 +241,7 @@ class WebAuthnManager:
     
     def verify_authentication(self, request_data):
         """Verify authentication response"""
-        if not WEBAUTHN_AVAILABLE:
+        if not _load_webauthn():
             return {'success': False, 'error': 'WebAuthn not available'}
         
         try:
@@ -157,8 +250,14 @@ class WebAuthnManager:
             if not user_id:
                 return {'success': False, 'error': 'No user ID in session'}
             
-            # Get credential ID from request
-            credential_id = base64url_to_bytes(request_data.get('id'))
+            # Parse the assertion once; its raw_id is the credential ID
+            credential_response = _parse_credential(AuthenticationCredential, request_data)
+            credential_id = credential_response.raw_id
+            
+            # Reject IDs that weren't offered without touching the database
+            allowed_ids = session.get('webauthn_cred_ids')
+            if allowed_ids is not None and credential_id not in allowed_ids:
+                return {'success': False, 'error': 'Credential not found'}
             
             # Get stored credential
             credential = self._get_credential(user_id, credential_id)
@@ -166,10 +265,14 @@ class WebAuthnManager:
             if not credential:
                 return {'success': False, 'error': 'Credential not found'}
             
+            challenge = self._take_challenge(session.get('webauthn_challenge_id'))
+            if challenge is None:
+                return {'success': False, 'error': 'Challenge expired or already used'}
+            
             # Verify authentication
             verification = verify_authentication_response(
-                credential=AuthenticationCredential.parse_raw(json.dumps(request_data)),
-                expected_challenge=session.get('webauthn_challenge'),
+                credential=credential_response,
+                expected_challenge=challenge,
                 expected_rp_id=self.rp_id,
                 expected_origin=self.origin,
                 credential_public_key=credential['public_key'],
@@ -184,8 +287,9 @@ class WebAuthnManager:
             )
             
             # Clear session data
-            session.pop('webauthn_challenge', None)
+            session.pop('webauthn_challenge_id', None)
             session.pop('webauthn_user_id', None)
+            session.pop('webauthn_cred_ids', None)
             
             # Store authentication success in session
             session['fingerprint_authenticated'] = True
@@ -196,66 +300,68 @@ class WebAuthnManager:
         except Exception as e:
             return {'success': False, 'error': str(e)}
     
-    def _store_credential(self, user_id, credential_id, public_key):
-        """Store WebAuthn credential in database"""
-        conn = sqlite3.connect(self.app.config['DATABASE'])
-        cursor = conn.cursor()
+    def _store_challenge(self, user_id, challenge):
+        """Save a pending challenge; returns its rowid"""
+        return self._db().execute('''
+            INSERT INTO webauthn_challenges (user_id, challenge, created_at)
+            VALUES (?, ?, ?)
+        ''', (user_id, challenge, int(time.time()))).lastrowid
+    
+    def _take_challenge(self, challenge_id):
+        """Fetch and delete a pending challenge, or None if unknown or expired"""
+        if challenge_id is None:
+            return None
         
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS webauthn_credentials (
-                id INTEGER PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                credential_id BLOB UNIQUE NOT NULL,
-                public_key BLOB NOT NULL,
-                sign_count INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        conn = self._db()
+        row = conn.execute('''
+            SELECT challenge, created_at FROM webauthn_challenges WHERE id = ?
+        ''', (challenge_id,)).fetchone()
+        
+        # Only the request whose DELETE removes the row may use it, so a
+        # challenge can't be answered twice
+        if row is None or conn.execute(
+                'DELETE FROM webauthn_challenges WHERE id = ?', (challenge_id,)).rowcount != 1:
+            return None
         
-        cursor.execute('''
-            INSERT OR REPLACE INTO webauthn_credentials 
+        challenge, created_at = row
+        if time.time() - created_at > CHALLENGE_TTL_SECONDS:
+            return None
+        return challenge
+    
+    def cleanup_expired_challenges(self):
+        """Delete challenges that were never answered"""
+        self._db().execute('''
+            DELETE FROM webauthn_challenges WHERE created_at < ?
+        ''', (int(time.time()) - CHALLENGE_TTL_SECONDS,))
+    
+    def _store_credential(self, user_id, credential_id, public_key):
+        """Store WebAuthn credential in database"""
+        # Re-registering an existing credential keeps its sign count, so a
+        # cloned authenticator can't reset the counter by registering again
+        self._db().execute('''
+            INSERT INTO webauthn_credentials 
             (user_id, credential_id, public_key)
             VALUES (?, ?, ?)
+            ON CONFLICT(credential_id) DO UPDATE SET public_key = excluded.public_key
         ''', (user_id, credential_id, public_key))
-        
-        conn.commit()
-        conn.close()
+        self._fp_cache.pop(user_id, None)
     
-    def _get_credentials(self, user_id):
-        """Get WebAuthn credentials for user"""
-        conn = sqlite3.connect(self.app.config['DATABASE'])
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT credential_id, public_key, sign_count 
-            FROM webauthn_credentials 
+    def _get_credential_ids(self, user_id):
+        """Get the IDs of a user's WebAuthn credentials"""
+        cursor = self._db().execute('''
+            SELECT credential_id FROM webauthn_credentials 
             WHERE user_id = ?
         ''', (user_id,))
         
-        credentials = []
-        for row in cursor.fetchall():
-            credentials.append({
-                'credential_id': row[0],
-                'public_key': row[1],
-                'sign_count': row[2]
-            })
-        
-        conn.close()
-        return credentials
+        return [credential_id for (credential_id,) in cursor]
     
     def _get_credential(self, user_id, credential_id):
         """Get specific WebAuthn credential"""
-        conn = sqlite3.connect(self.app.config['DATABASE'])
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        row = self._db().execute('''
             SELECT credential_id, public_key, sign_count 
             FROM webauthn_credentials 
-            WHERE user_id = ? AND credential_id = ?
-        ''', (user_id, credential_id))
-        
-        row = cursor.fetchone()
-        conn.close()
+            WHERE credential_id = ? AND user_id = ?
+        ''', (credential_id, user_id)).fetchone()
         
         if row:
             return {
@@ -268,29 +374,34 @@ class WebAuthnManager:
     
     def _update_sign_count(self, user_id, credential_id, new_sign_count):
         """Update sign count for credential"""
-        conn = sqlite3.connect(self.app.config['DATABASE'])
-        cursor = conn.cursor()
-        
-        cursor.execute('''
+        self._db().execute('''
             UPDATE webauthn_credentials 
             SET sign_count = ? 
-            WHERE user_id = ? AND credential_id = ?
-        ''', (new_sign_count, user_id, credential_id))
-        
-        conn.commit()
-        conn.close()
+            WHERE credential_id = ? AND user_id = ?
+        ''', (new_sign_count, credential_id, user_id))
     
-    def is_fingerprint_enabled(self, user_id):
-        """Check if fingerprint is enabled for user"""
-        conn = sqlite3.connect(self.app.config['DATABASE'])
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT COUNT(*) FROM webauthn_credentials 
+    def remove_credentials(self, user_id):
+        """Delete every WebAuthn credential for user"""
+        self._db().execute('''
+            DELETE FROM webauthn_credentials 
             WHERE user_id = ?
         ''', (user_id,))
+        self._fp_cache.pop(user_id, None)
+    
+    def is_fingerprint_enabled(self, user_id):
+        """Check if fingerprint is enabled for user"""
+        cached = self._fp_cache.get(user_id)
+        now = time.monotonic()
+        if cached and now - cached[1] < self._fp_cache_ttl:
+            return cached[0]
         
-        count = cursor.fetchone()[0]
-        conn.close()
+        enabled = self._db().execute('''
+            SELECT 1 FROM webauthn_credentials 
+            WHERE user_id = ? LIMIT 1
+        ''', (user_id,)).fetchone() is not None
         
-        return count > 0
\ No newline at end of file
+        if len(self._fp_cache) >= 1024:
+            # PIN sessions use their session id as user_id; forget stale ones
+            self._fp_cache.clear()
+        self._fp_cache[user_id] = (enabled, now)
+        return enabled
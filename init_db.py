@@ -6,17 +6,25 @@ import sqlite3
 import hashlib
 import os
 
+# Default PIN hashes, computed once at import
+_REAL_PIN_HASH = hashlib.sha256(b'0000').hexdigest()
+_FAKE_PIN_HASH = hashlib.sha256(b'123456').hexdigest()
+
 def initialize_database():
     # Create database directory
     os.makedirs('database', exist_ok=True)
     
-    # Connect to database
-    conn = sqlite3.connect('database/vantavault.db')
+    # Connect to database; autocommit mode so the whole setup runs in
+    # the single explicit transaction below
+    conn = sqlite3.connect('database/vantavault.db', isolation_level=None)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
     cursor = conn.cursor()
     
+    cursor.execute('BEGIN')
+    
     # Create tables (same as in vault.py)
-    cursor.executescript('''
-        -- Real vault settings
+    cursor.execute('''
         CREATE TABLE IF NOT EXISTS real_vault_settings (
             id INTEGER PRIMARY KEY,
             pin_hash TEXT NOT NULL,
@@ -25,26 +33,29 @@ def initialize_database():
             stealth_mode BOOLEAN DEFAULT 0,
             decoy_mode BOOLEAN DEFAULT 0,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        
-        -- Fake vault settings
+        )
+        ''')
+    
+    cursor.execute('''
         CREATE TABLE IF NOT EXISTS fake_vault_settings (
             id INTEGER PRIMARY KEY,
             pin_hash TEXT NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );
-        
-        -- Insert default PINs
+        )
+        ''')
+    
+    # Insert default PINs
+    cursor.execute('''
         INSERT OR IGNORE INTO real_vault_settings (pin_hash) 
-        VALUES (?)  -- SHA256 hash of "0000"
-        '''.replace('?', f"'{hashlib.sha256('0000'.encode()).hexdigest()}'"))
+        VALUES (?)
+        ''', (_REAL_PIN_HASH,))
     
     cursor.execute('''
         INSERT OR IGNORE INTO fake_vault_settings (pin_hash) 
         VALUES (?)
-        '''.replace('?', f"'{hashlib.sha256('123456'.encode()).hexdigest()}'"))
+        ''', (_FAKE_PIN_HASH,))
     
-    conn.commit()
+    cursor.execute('COMMIT')
     conn.close()
     print("✅ Database initialized successfully!")
     print("🔐 Default PIN for real vault: 0000")
@@ -4,68 +4,64 @@ Handles Progressive Web App functionality
 """
 import os
 import json
+import hashlib
+import gzip
 
-class PWA_Manager:
-    def __init__(self, app):
-        self.app = app
-        self.manifest_path = 'static/manifest.json'
-        self.service_worker_path = 'static/js/service-worker.js'
-        
-        # Ensure static directories exist
-        os.makedirs('static/css', exist_ok=True)
-        os.makedirs('static/js', exist_ok=True)
-        os.makedirs('static/icons', exist_ok=True)
-    
-    def generate_manifest(self):
-        """Generate web app manifest"""
-        manifest = {
-            "name": "VantaVault",
-            "short_name": "VantaVault",
-            "description": "High-security media vault",
-            "start_url": "/",
-            "display": "standalone",
-            "background_color": "#000000",
-            "theme_color": "#000000",
-            "orientation": "portrait",
-            "scope": "/",
-            "icons": [
-                {
-                    "src": "/static/icons/icon-192.png",
-                    "sizes": "192x192",
-                    "type": "image/png",
-                    "purpose": "any maskable"
-                },
-                {
-                    "src": "/static/icons/icon-512.png",
-                    "sizes": "512x512",
-                    "type": "image/png",
-                    "purpose": "any maskable"
-                }
-            ],
-            "categories": ["security", "productivity", "utilities"],
-            "shortcuts": [
-                {
-                    "name": "Open Vault",
-                    "short_name": "Vault",
-                    "description": "Open secure vault",
-                    "url": "/dashboard"
-                },
-                {
-                    "name": "Add Media",
-                    "short_name": "Add",
-                    "description": "Add new media to vault",
-                    "url": "/gallery?action=upload"
-                }
-            ]
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+# The manifest and service worker are static, so they are rendered once at
+# import and only written out when the copy on disk differs
+_MANIFEST = {
+    "name": "VantaVault",
+    "short_name": "VantaVault",
+    "description": "High-security media vault",
+    "start_url": "/",
+    "display": "standalone",
+    "background_color": "#000000",
+    "theme_color": "#000000",
+    "orientation": "portrait",
+    "scope": "/",
+    "icons": [
+        {
+            "src": "/static/icons/icon-192.png",
+            "sizes": "192x192",
+            "type": "image/png",
+            "purpose": "any maskable"
+        },
+        {
+            "src": "/static/icons/icon-512.png",
+            "sizes": "512x512",
+            "type": "image/png",
+            "purpose": "any maskable"
         }
-        
-        # Write manifest file
-        with open(self.manifest_path, 'w') as f:
-            json.dump(manifest, f, indent=2)
-    
-    def generate_service_worker(self):
-        """Generate service worker for offline support"""
-        sw_code = '''
+    ],
+    "categories": ["security", "productivity", "utilities"],
+    "shortcuts": [
+        {
+            "name": "Open Vault",
+            "short_name": "Vault",
+            "description": "Open secure vault",
+            "url": "/dashboard"
+        },
+        {
+            "name": "Add Media",
+            "short_name": "Add",
+            "description": "Add new media to vault",
+            "url": "/gallery?action=upload"
+        }
+    ]
+}
+if ORJSON_AVAILABLE:
+    _MANIFEST_BYTES = orjson.dumps(_MANIFEST)
+else:
+    _MANIFEST_BYTES = json.dumps(_MANIFEST, separators=(',', ':')).encode()
+_MANIFEST_SHA = hashlib.sha256(_MANIFEST_BYTES).digest()
+
+_SW_CODE = '''
 // VantaVault Service Worker
 const CACHE_NAME = 'vantavault-v1.0';
 const STATIC_CACHE = 'vantavault-static-v1.0';
@@ -228,10 +224,65 @@ self.addEventListener('notificationclick', event => {
     }
 });
 '''
+_SW_BYTES = _SW_CODE.encode()
+_SW_SHA = hashlib.sha256(_SW_BYTES).digest()
+
+def _write_if_changed(path, data, digest):
+    """Write data to path unless the file already holds exactly that"""
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, 'rb') as f:
+                if hashlib.sha256(f.read()).digest() == digest:
+                    return
+    except OSError:
+        pass
+    
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def ensure_gzip_copy(path):
+    """Keep a precompressed path + '.gz' next to path; returns it, or None"""
+    gz_path = path + '.gz'
+    try:
+        source_mtime = os.path.getmtime(path)
+        if os.path.getmtime(gz_path) >= source_mtime:
+            return gz_path
+    except OSError:
+        if not os.path.exists(path):
+            return None
+    
+    try:
+        with open(path, 'rb') as f:
+            data = gzip.compress(f.read(), compresslevel=9, mtime=0)
+        temp_path = f'{gz_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, gz_path)
+    except OSError:
+        return None
+    
+    return gz_path
+
+class PWA_Manager:
+    def __init__(self, app):
+        self.app = app
+        self.manifest_path = 'static/manifest.json'
+        self.service_worker_path = 'static/js/service-worker.js'
         
-        # Write service worker file
-        with open(self.service_worker_path, 'w') as f:
-            f.write(sw_code)
+        # Ensure static directories exist
+        os.makedirs('static/css', exist_ok=True)
+        os.makedirs('static/js', exist_ok=True)
+        os.makedirs('static/icons', exist_ok=True)
+    
+    def generate_manifest(self):
+        """Generate web app manifest"""
+        _write_if_changed(self.manifest_path, _MANIFEST_BYTES, _MANIFEST_SHA)
+        ensure_gzip_copy(self.manifest_path)
+    
+    def generate_service_worker(self):
+        """Generate service worker for offline support"""
+        _write_if_changed(self.service_worker_path, _SW_BYTES, _SW_SHA)
+        ensure_gzip_copy(self.service_worker_path)
     
     def register_pwa(self):
         """Register PWA with Flask app"""
@@ -7,19 +7,60 @@ import os
 import sys
 import subprocess
 import webbrowser
-import time
+import threading
+import base64
+import hashlib
+import importlib.util
 from pathlib import Path
 
+# Placeholder icons (black square, white vault outline and lock), pre-rendered
+# as 1-bit PNGs so startup never has to draw them with Pillow
+_ICON_192_B64 = (
+    b'iVBORw0KGgoAAAANSUhEUgAAAMAAAADAAQAAAAB6p1GqAAAAXklEQVR42u2UMQ6AQAgE'
+    b'F2Nh5xN8qvpkew0WJhZnrJXNTEUYmg0BCXyZ8sEudW/jBcUWDYO8AiIQJcT1Xhbj5GtE'
+    b'sHMEAvEjMWemX8D+roKdIxAf3eCYbffwCQjVOQHkIyHRgIq78QAAAABJRU5ErkJggg=='
+)
+_ICON_512_B64 = (
+    b'iVBORw0KGgoAAAANSUhEUgAAAgAAAAIAAQAAAADcA+lXAAAAyElEQVR42u3aMQqDQBRF'
+    b'0T9hIGWyA5dqslO3YGcjWogGBEGZwjCc2yjIHOS1GiFJkiRJ1ZaWS9NdPjnmiIh4lL4B'
+    b'AAAAAKoC8nbXvy8cew5GBAAAAAAAAAAAAAAAAAAAAAAAAKA6YNr1MSIAAAAACoFvWjMi'
+    b'AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAG4A2u13KCMCAAAA4GT56EEyIgAAAAAAAAAA'
+    b'AAAAAAAAAAAAAACVAr/PA6/JiAAAAAAoBiRJkiTpf5sBaLwiu7/LISAAAAAASUVORK5C'
+    b'YII='
+)
+_ICONS = {192: _ICON_192_B64, 512: _ICON_512_B64}
+
+# Written after a successful dependency check; holds a hash of the Python
+# version and requirements.txt mtime, so later launches can skip the check
+DEPS_STAMP = Path('.vv_deps_ok')
+
+def _deps_fingerprint():
+    """Identify the interpreter and requirements the check was run against"""
+    try:
+        requirements_mtime = os.path.getmtime('requirements.txt')
+    except OSError:
+        requirements_mtime = 0
+    return hashlib.sha256(f'{sys.version}|{requirements_mtime}'.encode()).hexdigest()
+
 def check_dependencies():
     """Check if all required Python packages are installed"""
-    required = ['flask', 'cryptography', 'pillow']
-    missing = []
+    fingerprint = _deps_fingerprint()
+    try:
+        if DEPS_STAMP.read_text() == fingerprint:
+            return []
+    except OSError:
+        pass
+    
+    # package name -> import name; find_spec locates them without importing
+    required = {'flask': 'flask', 'cryptography': 'cryptography', 'pillow': 'PIL'}
+    missing = [package for package, module in required.items()
+               if importlib.util.find_spec(module) is None]
     
-    for package in required:
+    if not missing:
         try:
-            __import__(package.replace('-', '_'))
-        except ImportError:
-            missing.append(package)
+            DEPS_STAMP.write_text(fingerprint)
+        except OSError:
+            pass
     
     return missing
 
@@ -42,33 +83,11 @@ def setup_environment():
     print("✅ Environment setup complete")
 
 def generate_icons():
-    """Generate placeholder icons if they don't exist"""
-    icon_sizes = [192, 512]
-    
-    for size in icon_sizes:
-        icon_path = f'static/icons/icon-{size}.png'
-        if not Path(icon_path).exists():
-            # Create simple placeholder icon
-            from PIL import Image, ImageDraw
-            
-            img = Image.new('RGB', (size, size), color='black')
-            draw = ImageDraw.Draw(img)
-            
-            # Draw vault icon
-            border = size // 10
-            draw.rectangle([border, border, size-border, size-border], 
-                          outline='white', width=border//2)
-            
-            # Draw lock
-            lock_height = size // 3
-            lock_width = size // 4
-            lock_x = (size - lock_width) // 2
-            lock_y = size // 2 - lock_height // 2
-            
-            draw.rectangle([lock_x, lock_y, lock_x+lock_width, lock_y+lock_height],
-                          outline='white', width=border//2)
-            
-            img.save(icon_path)
+    """Write placeholder icons if they don't exist"""
+    for size, icon_b64 in _ICONS.items():
+        icon_path = Path(f'static/icons/icon-{size}.png')
+        if not icon_path.exists():
+            icon_path.write_bytes(base64.b64decode(icon_b64))
             print(f"✅ Generated icon: {icon_path}")
 
 def initialize_database():
@@ -136,46 +155,35 @@ def main():
     print("   - Fake vault: 123456")
     print("\n⚠️  Important: Accept the SSL certificate warning in your browser")
     
-    # Open browser after delay
-    time.sleep(2)
-    
     try:
         # Import and run the app
         from app import app
         
-        # Start Flask in a separate thread to keep console responsive
-        import threading
-        
-        def run_app():
-            app.run(
-                ssl_context='adhoc',
-                host='0.0.0.0',
-                port=5000,
-                debug=True,
-                use_reloader=False
-            )
-        
-        # Start Flask thread
-        flask_thread = threading.Thread(target=run_app, daemon=True)
-        flask_thread.start()
-        
-        # Wait a moment for server to start
-        time.sleep(3)
+        # Open the browser once the server has had a moment to start
+        def open_browser():
+            print("\n🌐 Opening browser...")
+            webbrowser.open('https://localhost:5000')
         
-        # Open browser
-        print("\n🌐 Opening browser...")
-        webbrowser.open('https://localhost:5000')
+        browser_timer = threading.Timer(2.0, open_browser)
+        browser_timer.daemon = True
+        browser_timer.start()
         
-        # Keep script running
         print("\n🔄 Server is running. Press Ctrl+C to stop.")
         print("\n📋 Useful URLs:")
         print("   - Main app: https://localhost:5000")
         print("   - Dashboard: https://localhost:5000/dashboard")
         print("   - Settings: https://localhost:5000/settings")
         
-        # Keep main thread alive
-        while True:
-            time.sleep(1)
+        # Serve on the main thread. Waitress can't terminate TLS, and
+        # WebAuthn needs HTTPS, so this stays on the Werkzeug server with
+        # an ad-hoc certificate, without the debugger
+        app.run(
+            ssl_context='adhoc',
+            host='0.0.0.0',
+            port=5000,
+            debug=False,
+            threaded=True
+        )
             
     except KeyboardInterrupt:
         print("\n\n👋 Shutting down VantaVault...")
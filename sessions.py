@@ -0,0 +1,102 @@
+"""
+VantaVault - Session Store
+In-memory session table with heap-based expiry and a size cap
+"""
+import time
+import heapq
+import threading
+
+class SessionStore:
+    def __init__(self, timeout=1800, maxsize=10000):
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self._sessions = {}
+        # (expiry, session_id) min-heap; one entry per live session
+        self._expiry_heap = []
+        self._lock = threading.Lock()
+    
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+    
+    def __getitem__(self, session_id):
+        return self._sessions[session_id]
+    
+    def __setitem__(self, session_id, session_data):
+        if session_id not in self._sessions and len(self._sessions) >= self.maxsize:
+            # Full: drop expired sessions, then the ones closest to expiring
+            self.sweep()
+            with self._lock:
+                self._evict(len(self._sessions) - self.maxsize + 1)
+        
+        with self._lock:
+            self._sessions[session_id] = session_data
+            heapq.heappush(self._expiry_heap,
+                           (session_data['last_activity'] + self.timeout, session_id))
+    
+    def __delitem__(self, session_id):
+        with self._lock:
+            # The heap entry is dropped lazily by sweep()
+            self._sessions.pop(session_id, None)
+    
+    def __len__(self):
+        return len(self._sessions)
+    
+    def get(self, session_id, default=None):
+        return self._sessions.get(session_id, default)
+    
+    def clear(self):
+        """Drop all sessions"""
+        with self._lock:
+            self._sessions.clear()
+            self._expiry_heap.clear()
+    
+    def is_expired(self, session_id):
+        """Check if a session has been idle longer than the timeout"""
+        session_data = self._sessions.get(session_id)
+        if session_data is None:
+            return True
+        return time.time() - session_data['last_activity'] > self.timeout
+    
+    def touch(self, session_id):
+        """Record activity for a session"""
+        session_data = self._sessions.get(session_id)
+        if session_data is not None:
+            # The heap entry is refreshed lazily by sweep()
+            session_data['last_activity'] = time.time()
+    
+    def sweep(self):
+        """Remove expired sessions, popping only heap entries that are due"""
+        now = time.time()
+        heap = self._expiry_heap
+        
+        with self._lock:
+            while heap and heap[0][0] <= now:
+                _, session_id = heapq.heappop(heap)
+                session_data = self._sessions.get(session_id)
+                if session_data is None:
+                    continue
+                
+                expiry = session_data['last_activity'] + self.timeout
+                if expiry <= now:
+                    del self._sessions[session_id]
+                else:
+                    # Touched since it was queued; requeue at its real expiry
+                    heapq.heappush(heap, (expiry, session_id))
+    
+    def _evict(self, count):
+        """Remove up to count sessions in expiry order (caller holds the lock)"""
+        heap = self._expiry_heap
+        while count > 0 and heap:
+            expiry, session_id = heapq.heappop(heap)
+            session_data = self._sessions.get(session_id)
+            if session_data is None:
+                continue
+            
+            actual_expiry = session_data['last_activity'] + self.timeout
+            if actual_expiry > expiry:
+                # Stale entry for a session touched since; requeue it
+                heapq.heappush(heap, (actual_expiry, session_id))
+                continue
+            
+            del self._sessions[session_id]
+            count -= 1
@@ -138,8 +138,10 @@ class PinLock {
                 localStorage.setItem('lastUnlock', new Date().toISOString());
                 
                 if (data.vault_type === 'real') {
-                    // Redirect to unlock animation
-                    window.location.href = `/unlock/animation?token=${data.animation_token}`;
+                    // Redirect to unlock animation (skipped when rate limited)
+                    window.location.href = data.animation_token
+                        ? `/unlock/animation?token=${data.animation_token}`
+                        : '/dashboard';
                 } else {
                     // Redirect to fake vault
                     window.location.href = '/dashboard';
@@ -294,8 +296,10 @@ class PinLock {
                 // Store last unlock time
                 localStorage.setItem('lastUnlock', new Date().toISOString());
                 
-                // Redirect to unlock animation
-                window.location.href = `/unlock/animation?token=${verificationData.animation_token}`;
+                // Redirect to unlock animation (skipped when rate limited)
+                window.location.href = verificationData.animation_token
+                    ? `/unlock/animation?token=${verificationData.animation_token}`
+                    : '/dashboard';
             } else {
                 throw new Error('Verification failed');
             }
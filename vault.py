@@ -12,14 +12,265 @@ import base64
 import random
 from datetime import datetime, timedelta
 import shutil
+import threading
+import queue
+import atexit
+import io
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
 
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from encryption import _device_is_solid_state
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+try:
+    from argon2 import PasswordHasher
+    from argon2.exceptions import VerificationError, InvalidHashError
+    ARGON2_AVAILABLE = True
+except ImportError:
+    ARGON2_AVAILABLE = False
+
+# Read size for legacy XOR-encrypted files (a multiple of the 32-byte key)
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Secondary indexes for the hot lookups, as (table, CREATE INDEX statement).
+# failed_attempts needs none: UNIQUE(ip_address) already indexes it.
+INDEXES = [
+    ('real_media', 'CREATE INDEX IF NOT EXISTS idx_rm_folder '
+                   'ON real_media(folder_id, is_deleted, upload_date DESC)'),
+    ('fake_media', 'CREATE INDEX IF NOT EXISTS idx_fm_folder '
+                   'ON fake_media(folder_id, upload_date DESC)'),
+    ('auth_logs', 'CREATE INDEX IF NOT EXISTS idx_auth_ts ON auth_logs(timestamp)'),
+    ('auth_logs', 'CREATE INDEX IF NOT EXISTS idx_auth_vault_ts '
+                  'ON auth_logs(vault_type, timestamp DESC)'),
+    ('folders', 'CREATE INDEX IF NOT EXISTS idx_folders_parent '
+                'ON folders(vault_type, parent_id, sort_order, name)'),
+    ('share_links', 'CREATE INDEX IF NOT EXISTS idx_share_expiry '
+                    'ON share_links(expiry_time)'),
+    ('recycle_bin', 'CREATE INDEX IF NOT EXISTS idx_rb_auto_delete '
+                    'ON recycle_bin(auto_delete_at)'),
+    ('real_media', 'CREATE INDEX IF NOT EXISTS idx_rm_upload '
+                   'ON real_media(is_deleted, upload_date)'),
+    ('fake_media', 'CREATE INDEX IF NOT EXISTS idx_fm_upload '
+                   'ON fake_media(upload_date)'),
+]
+
+# Per-vault file count and size, kept current by triggers so storage
+# stats don't aggregate the media tables. The real vault counts only
+# media that isn't in the recycle bin
+VAULT_STATS_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS vault_stats (
+        vault_type TEXT PRIMARY KEY,
+        file_count INTEGER NOT NULL DEFAULT 0,
+        total_size INTEGER NOT NULL DEFAULT 0
+    )''',
+    '''CREATE TRIGGER IF NOT EXISTS real_media_stats_insert
+    AFTER INSERT ON real_media WHEN NEW.is_deleted IS 0 BEGIN
+        UPDATE vault_stats SET file_count = file_count + 1,
+            total_size = total_size + IFNULL(NEW.file_size, 0)
+        WHERE vault_type = 'real';
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS real_media_stats_delete
+    AFTER DELETE ON real_media WHEN OLD.is_deleted IS 0 BEGIN
+        UPDATE vault_stats SET file_count = file_count - 1,
+            total_size = total_size - IFNULL(OLD.file_size, 0)
+        WHERE vault_type = 'real';
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS real_media_stats_update
+    AFTER UPDATE OF is_deleted, file_size ON real_media BEGIN
+        UPDATE vault_stats SET
+            file_count = file_count - (OLD.is_deleted IS 0) + (NEW.is_deleted IS 0),
+            total_size = total_size
+                - IIF(OLD.is_deleted IS 0, IFNULL(OLD.file_size, 0), 0)
+                + IIF(NEW.is_deleted IS 0, IFNULL(NEW.file_size, 0), 0)
+        WHERE vault_type = 'real';
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS fake_media_stats_insert
+    AFTER INSERT ON fake_media BEGIN
+        UPDATE vault_stats SET file_count = file_count + 1,
+            total_size = total_size + IFNULL(NEW.file_size, 0)
+        WHERE vault_type = 'fake';
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS fake_media_stats_delete
+    AFTER DELETE ON fake_media BEGIN
+        UPDATE vault_stats SET file_count = file_count - 1,
+            total_size = total_size - IFNULL(OLD.file_size, 0)
+        WHERE vault_type = 'fake';
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS fake_media_stats_update
+    AFTER UPDATE OF file_size ON fake_media BEGIN
+        UPDATE vault_stats SET
+            total_size = total_size - IFNULL(OLD.file_size, 0) + IFNULL(NEW.file_size, 0)
+        WHERE vault_type = 'fake';
+    END''',
+]
+
+# Mimetypes by extension; a fixed table, since the system mimetypes
+# database differs between platforms (and is sparse on Termux)
+MIME_TYPES = {
+    # Images
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.bmp': 'image/bmp',
+    '.webp': 'image/webp',
+    '.tiff': 'image/tiff',
+    '.ico': 'image/x-icon',
+
+    # Videos
+    '.mp4': 'video/mp4',
+    '.mov': 'video/quicktime',
+    '.avi': 'video/x-msvideo',
+    '.mkv': 'video/x-matroska',
+    '.webm': 'video/webm',
+    '.flv': 'video/x-flv',
+    '.wmv': 'video/x-ms-wmv',
+    '.m4v': 'video/x-m4v',
+    '.3gp': 'video/3gpp',
+
+    # Audio
+    '.mp3': 'audio/mpeg',
+    '.wav': 'audio/wav',
+    '.ogg': 'audio/ogg',
+    '.m4a': 'audio/mp4',
+    '.flac': 'audio/flac',
+
+    # Documents
+    '.pdf': 'application/pdf',
+    '.txt': 'text/plain',
+    '.md': 'text/markdown',
+    '.doc': 'application/msword',
+    '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    '.xls': 'application/vnd.ms-excel',
+    '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    '.ppt': 'application/vnd.ms-powerpoint',
+    '.pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+}
+
+# real_vault_settings columns that get_settings() exposes (all but pin_hash)
+VAULT_SETTING_COLUMNS = frozenset({
+    'id', 'fingerprint_enabled', 'auto_lock_minutes', 'stealth_mode',
+    'decoy_mode', 'created_at', 'updated_at'
+})
+
+# Prebuilt UPDATE per writable real_vault_settings column, so each one is
+# always the same SQL text (and a statement cache hit)
+VAULT_SETTING_UPDATES = {
+    key: f'UPDATE real_vault_settings SET {key} = ?, updated_at = CURRENT_TIMESTAMP'
+    for key in ('fingerprint_enabled', 'auto_lock_minutes', 'stealth_mode', 'decoy_mode')
+}
+
+# Decoders for the app_settings type column
+SETTING_DECODERS = {
+    'int': int,
+    'bool': lambda value: value.lower() == 'true',
+    'json': json.loads,
+    'str': str,
+}
+
+# Well-formed stand-in hash (zero salt and key) verified against when a
+# vault has no PIN yet, so verify_pin always does the same work
+PLACEHOLDER_PIN_HASH = base64.urlsafe_b64encode(bytes(48)).decode()
+
+# Media files are AES-256-GCM in independently sealed segments:
+#   MAGIC | 8-byte nonce prefix | segment 0 | segment 1 | ...
+# Each segment is SEGMENT_SIZE bytes of plaintext (the last may be shorter)
+# followed by its 16-byte tag, sealed with nonce = prefix | big-endian index
+# and a one-byte AAD marking the final segment, so segments can't be
+# reordered or the file truncated. Files without MAGIC are the old XOR format.
+MEDIA_MAGIC = b'VVG1'
+MEDIA_HEADER_SIZE = len(MEDIA_MAGIC) + 8
+MEDIA_SEGMENT_SIZE = 1024 * 1024
+MEDIA_TAG_SIZE = 16
+
+# Stored in PRAGMA user_version once a database is initialized and fully
+# migrated; 0 means first run (or a vault from before it was recorded)
+SCHEMA_VERSION = 7
+
+# Thumbnails (and legacy media) are XORed; the thumbnail key is fixed
+_THUMBNAIL_KEY = hashlib.sha256(b'thumbnail_key').digest()
+
+# Part size for chunked uploads (one part per segment, so parts can be
+# sealed independently) and how long an unfinished upload is kept before
+# its partial file is discarded
+UPLOAD_CHUNK_SIZE = MEDIA_SEGMENT_SIZE
+UPLOAD_TTL_SECONDS = 3600
+
+# Largest image decoded in memory to thumbnail a chunked upload; bigger
+# ones get the simple fallback thumbnail
+THUMBNAIL_SOURCE_LIMIT = 32 * 1024 * 1024
+
+# Auth log rows are written by a background thread, batched for up to
+# this long (or this many rows) per transaction
+AUTH_LOG_FLUSH_SECONDS = 0.1
+AUTH_LOG_BATCH_SIZE = 100
+
+# WebAuthn credentials, clustered on credential_id (the lookup key); the
+# public keys are small COSE blobs, so rows stay well under a page
+WEBAUTHN_CREDENTIALS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS webauthn_credentials (
+        credential_id BLOB NOT NULL,
+        user_id TEXT NOT NULL,
+        public_key BLOB NOT NULL,
+        sign_count INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (credential_id)
+    ) WITHOUT ROWID
+'''
+
+# Per-file media keys. Deleting a file destroys its key, which makes the
+# ciphertext unrecoverable without overwriting it (crypto-shredding)
+MEDIA_KEYS_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS media_keys (
+        encrypted_path TEXT PRIMARY KEY,
+        key BLOB NOT NULL
+    ) WITHOUT ROWID
+'''
+
+
+@lru_cache(maxsize=128)
+def _session_media_key(session_id: str) -> bytes:
+    """AES-256 media key for a session, cached across file operations"""
+    return hashlib.blake2b(session_id.encode(), digest_size=32,
+                           person=b'vantavault-media').digest()
+
+
+@lru_cache(maxsize=128)
+def _legacy_session_key(session_id: str) -> bytes:
+    """XOR key used by media stored before the AES-GCM format"""
+    return hashlib.sha256(session_id.encode()).digest()
+
+
 class VaultManager:
     def __init__(self, db_path):
         self.db_path = db_path
         self.real_storage = 'encrypted_storage/real/'
         self.fake_storage = 'encrypted_storage/fake/'
         
+        # Argon2id for new PIN hashes; PBKDF2 hashes remain verifiable
+        self._ph = PasswordHasher(time_cost=3, memory_cost=65536, parallelism=2) \
+            if ARGON2_AVAILABLE else None
+        
+        # One connection per thread, kept open for the process lifetime
+        self._local = threading.local()
+        
+        # Queued auth log rows; the writer thread starts on first use
+        self._log_queue = queue.Queue()
+        self._log_thread = None
+        self._log_lock = threading.Lock()
+        
+        # In-progress chunked uploads, keyed by upload_id
+        self._uploads = {}
+        self._uploads_lock = threading.Lock()
+        
         # Ensure storage directories
         for path in [self.real_storage, self.fake_storage]:
             os.makedirs(path, exist_ok=True)
@@ -27,32 +278,87 @@ class VaultManager:
         # Check and fix schema on initialization
         self.check_and_fix_schema()
     
+    def _connect(self):
+        """Get this thread's database connection (WAL, tuned pragmas)
+        
+        Release it with _release() before calling another method that
+        uses the database, since both would share the same connection.
+        """
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Statements are cached per connection, keyed by their SQL text
+            conn = sqlite3.connect(self.db_path, check_same_thread=False,
+                                   cached_statements=256)
+            conn.executescript('''
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                PRAGMA temp_store=MEMORY;
+                PRAGMA cache_size=-20000;
+            ''')
+            self._local.conn = conn
+        elif conn.in_transaction:
+            # An earlier call raised before committing; drop its writes
+            conn.rollback()
+        return conn
+    
+    def _release(self, conn):
+        """Finish with the connection, discarding uncommitted work as close() did"""
+        conn.rollback()
+    
+    @contextmanager
+    def _transaction(self, conn):
+        """Run a group of writes as one BEGIN IMMEDIATE transaction
+        
+        Taking the write lock up front means a read followed by writes
+        can't fail with SQLITE_BUSY when upgrading; it is committed on
+        exit (including an early return) and rolled back on error.
+        """
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn.cursor()
+        except BaseException:
+            conn.rollback()
+            raise
+        conn.commit()
+    
     def is_first_time(self):
         """Check if this is the first time app is launched"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
         try:
-            # Check if real_vault_settings table exists and has data
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='real_vault_settings'")
-            if not cursor.fetchone():
-                return True
-            
-            cursor.execute("SELECT COUNT(*) FROM real_vault_settings")
-            count = cursor.fetchone()[0]
-            return count == 0
+            cursor.execute('PRAGMA user_version')
+            if cursor.fetchone()[0] != 0:
+                return False
             
-        except:
+            # Version 0 is also an older vault whose migration hasn't
+            # completed; a PIN row means it is set up, so fail closed
+            return not self._has_vault_settings(cursor)
+        except sqlite3.Error:
             return True
         finally:
-            conn.close()
+            self._release(conn)
+    
+    @staticmethod
+    def _has_vault_settings(cursor) -> bool:
+        """Whether real_vault_settings exists and holds a row"""
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='real_vault_settings'")
+        if not cursor.fetchone():
+            return False
+        cursor.execute('SELECT 1 FROM real_vault_settings LIMIT 1')
+        return cursor.fetchone() is not None
     
     def check_and_fix_schema(self):
         """Check database schema and fix issues"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
         try:
+            # Current databases need no catalog probes at all
+            cursor.execute('PRAGMA user_version')
+            if cursor.fetchone()[0] >= SCHEMA_VERSION:
+                return
+            
             # Check if failed_attempts table exists
             cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='failed_attempts'")
             if cursor.fetchone():
@@ -68,16 +374,140 @@ class VaultManager:
                     ''')
                     conn.commit()
                     print("✅ Schema updated successfully")
+            
+            # Record whether each thumbnail was written, so serving one
+            # doesn't have to probe the filesystem
+            for table in ('real_media', 'fake_media'):
+                cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table,))
+                if not cursor.fetchone():
+                    continue
+                
+                cursor.execute(f"PRAGMA table_info({table})")
+                columns = [col[1] for col in cursor.fetchall()]
+                
+                if 'thumbnail_exists' not in columns:
+                    print(f"Adding missing column: thumbnail_exists to {table} table")
+                    cursor.execute(f'''
+                        ALTER TABLE {table} 
+                        ADD COLUMN thumbnail_exists BOOLEAN DEFAULT 0
+                    ''')
+                    cursor.execute(f'SELECT id, thumbnail_path FROM {table}')
+                    existing = [(media_id,) for media_id, thumbnail_path in cursor.fetchall()
+                                if thumbnail_path and os.path.exists(thumbnail_path)]
+                    cursor.executemany(f'UPDATE {table} SET thumbnail_exists = 1 WHERE id = ?', existing)
+                    conn.commit()
+                    print("✅ Schema updated successfully")
+            
+            # Record each app setting's type, so reads don't have to guess
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='app_settings'")
+            if cursor.fetchone():
+                cursor.execute("PRAGMA table_info(app_settings)")
+                columns = [col[1] for col in cursor.fetchall()]
+                
+                if 'type' not in columns:
+                    print("Adding missing column: type to app_settings table")
+                    cursor.execute('ALTER TABLE app_settings ADD COLUMN type TEXT')
+                    cursor.execute('SELECT key, value FROM app_settings')
+                    cursor.executemany('UPDATE app_settings SET type = ? WHERE key = ?',
+                                       [(self._infer_setting_type(value), key)
+                                        for key, value in cursor.fetchall()])
+                    conn.commit()
+                    print("✅ Schema updated successfully")
+            
+            # Databases created before the indexes existed
+            self._create_indexes(cursor)
+            conn.commit()
+            
+            # Credentials are looked up by credential_id, so store them in a
+            # WITHOUT ROWID table clustered on it instead of a rowid table
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='webauthn_credentials'")
+            row = cursor.fetchone()
+            if row and 'WITHOUT ROWID' not in row[0].upper():
+                print("Rebuilding webauthn_credentials as a WITHOUT ROWID table")
+                cursor.executescript(f'''
+                    BEGIN;
+                    ALTER TABLE webauthn_credentials RENAME TO webauthn_credentials_old;
+                    {WEBAUTHN_CREDENTIALS_SCHEMA};
+                    INSERT OR IGNORE INTO webauthn_credentials
+                        (credential_id, user_id, public_key, sign_count, created_at)
+                    SELECT credential_id, user_id, public_key, sign_count, created_at
+                    FROM webauthn_credentials_old;
+                    DROP TABLE webauthn_credentials_old;
+                    COMMIT;
+                ''')
+                print("✅ Schema updated successfully")
+            
+            # Databases from before the storage stats triggers
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='vault_stats'")
+            if not cursor.fetchone():
+                cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type='table' AND name IN ('real_media', 'fake_media')")
+                if cursor.fetchone()[0] == 2:
+                    self._create_vault_stats(cursor)
+                    conn.commit()
+            
+            # Databases from before per-file media keys
+            cursor.execute(MEDIA_KEYS_SCHEMA)
+            conn.commit()
+            
+            # Share links used to be written from Python: local time with
+            # microseconds (and sometimes a 'T' separator), which doesn't
+            # compare correctly against the UTC CURRENT_TIMESTAMP. Their
+            # max_views also held the creator's session id instead of a count
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='share_links'")
+            if cursor.fetchone():
+                cursor.execute('''
+                    UPDATE share_links
+                    SET expiry_time = COALESCE(datetime(expiry_time, 'utc'), expiry_time)
+                    WHERE expiry_time LIKE '%T%' OR expiry_time LIKE '%.%'
+                ''')
+                cursor.execute('''
+                    UPDATE share_links SET max_views = 1
+                    WHERE typeof(max_views) NOT IN ('integer', 'null')
+                ''')
+                conn.commit()
+            
+            # Stamp vaults set up before the version was recorded, once
+            # they are migrated; empty databases stay at 0 (first run)
+            if self._has_vault_settings(cursor):
+                cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
         except Exception as e:
             print(f"Schema check error: {e}")
         finally:
-            conn.close()
+            self._release(conn)
+    
+    def _create_indexes(self, cursor):
+        """Create the secondary indexes for whichever tables exist"""
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        tables = {row[0] for row in cursor.fetchall()}
+        
+        for table, statement in INDEXES:
+            if table in tables:
+                cursor.execute(statement)
+    
+    def _create_vault_stats(self, cursor):
+        """Create the vault_stats table and triggers, seeded from the media tables"""
+        for statement in VAULT_STATS_SCHEMA:
+            cursor.execute(statement)
+        
+        cursor.execute('''
+            INSERT OR REPLACE INTO vault_stats (vault_type, file_count, total_size)
+            SELECT 'real', COUNT(*), IFNULL(SUM(file_size), 0)
+            FROM real_media WHERE is_deleted = 0
+        ''')
+        cursor.execute('''
+            INSERT OR REPLACE INTO vault_stats (vault_type, file_count, total_size)
+            SELECT 'fake', COUNT(*), IFNULL(SUM(file_size), 0) FROM fake_media
+        ''')
     
     def initialize_database(self, real_pin=None, fake_pin=None):
         """Initialize SQLite database with all required tables"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
+        # Create and seed everything in one transaction (one fsync)
+        if not conn.in_transaction:
+            cursor.execute('BEGIN')
+        
         # Real vault settings
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS real_vault_settings (
@@ -109,6 +539,7 @@ class VaultManager:
                 original_filename TEXT NOT NULL,
                 encrypted_path TEXT NOT NULL,
                 thumbnail_path TEXT,
+                thumbnail_exists BOOLEAN DEFAULT 0,
                 folder_id TEXT DEFAULT 'default',
                 file_size INTEGER NOT NULL,
                 mimetype TEXT NOT NULL,
@@ -134,6 +565,7 @@ class VaultManager:
                 filename TEXT NOT NULL,
                 encrypted_path TEXT NOT NULL,
                 thumbnail_path TEXT,
+                thumbnail_exists BOOLEAN DEFAULT 0,
                 folder_id TEXT DEFAULT 'default',
                 file_size INTEGER NOT NULL,
                 mimetype TEXT NOT NULL,
@@ -218,17 +650,10 @@ class VaultManager:
         ''')
         
         # WebAuthn credentials
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS webauthn_credentials (
-                id INTEGER PRIMARY KEY,
-                user_id TEXT NOT NULL,
-                credential_id BLOB UNIQUE NOT NULL,
-                public_key BLOB NOT NULL,
-                sign_count INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                last_used TIMESTAMP
-            )
-        ''')
+        cursor.execute(WEBAUTHN_CREDENTIALS_SCHEMA)
+        
+        # Media keys
+        cursor.execute(MEDIA_KEYS_SCHEMA)
         
         # App settings
         cursor.execute('''
@@ -236,6 +661,7 @@ class VaultManager:
                 key TEXT PRIMARY KEY,
                 value TEXT NOT NULL,
                 category TEXT DEFAULT 'general',
+                type TEXT,
                 updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
@@ -272,7 +698,7 @@ class VaultManager:
                 fake_pin_hash = self._hash_pin(fake_pin)
             else:
                 # Generate random 6-digit fake PIN
-                fake_pin = ''.join([str(random.randint(0, 9)) for _ in range(6)])
+                fake_pin = f'{secrets.randbelow(1_000_000):06d}'
                 fake_pin_hash = self._hash_pin(fake_pin)
             
             cursor.execute('''
@@ -282,37 +708,50 @@ class VaultManager:
         
         # Initialize default app settings
         default_settings = [
-            ('theme', 'dark', 'appearance'),
-            ('auto_lock_minutes', '5', 'security'),
-            ('stealth_mode', '0', 'security'),
-            ('decoy_mode', '1', 'security'),
-            ('fingerprint_enabled', '0', 'security'),
-            ('thumbnail_quality', '85', 'media'),
-            ('recycle_bin_expiry_days', '7', 'privacy'),
-            ('max_upload_size_mb', '100', 'storage'),
-            ('share_expiry_hours', '24', 'sharing'),
-            ('auto_backup', '0', 'backup'),
-            ('backup_frequency_days', '7', 'backup'),
-            ('font_size', 'medium', 'accessibility'),
-            ('animations_enabled', '1', 'appearance'),
-            ('high_contrast', '0', 'accessibility'),
-            ('first_run_completed', '0', 'system')
+            ('theme', 'dark', 'appearance', 'str'),
+            ('auto_lock_minutes', '5', 'security', 'int'),
+            ('stealth_mode', '0', 'security', 'int'),
+            ('decoy_mode', '1', 'security', 'int'),
+            ('fingerprint_enabled', '0', 'security', 'int'),
+            ('thumbnail_quality', '85', 'media', 'int'),
+            ('recycle_bin_expiry_days', '7', 'privacy', 'int'),
+            ('max_upload_size_mb', '100', 'storage', 'int'),
+            ('share_expiry_hours', '24', 'sharing', 'int'),
+            ('auto_backup', '0', 'backup', 'int'),
+            ('backup_frequency_days', '7', 'backup', 'int'),
+            ('font_size', 'medium', 'accessibility', 'str'),
+            ('animations_enabled', '1', 'appearance', 'int'),
+            ('high_contrast', '0', 'accessibility', 'int'),
+            ('first_run_completed', '0', 'system', 'int')
         ]
         
-        for key, value, category in default_settings:
-            cursor.execute('''
-                INSERT OR IGNORE INTO app_settings (key, value, category)
-                VALUES (?, ?, ?)
-            ''', (key, value, category))
+        # One multi-row INSERT: a single prepare and step for every default
+        placeholders = ', '.join(['(?, ?, ?, ?)'] * len(default_settings))
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO app_settings (key, value, category, type)
+            VALUES {placeholders}
+        ''', [value for row in default_settings for value in row])
+        
+        self._create_indexes(cursor)
+        self._create_vault_stats(cursor)
+        
+        # Marks the vault as set up; transactional, so it commits with the rest
+        cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
         
         conn.commit()
-        conn.close()
+        
+        # Give the planner statistics for the new indexes
+        cursor.execute('ANALYZE')
+        self._release(conn)
         
         print(f"✅ Database initialized at: {self.db_path}")
         return True
     
     def _hash_pin(self, pin: str) -> str:
-        """Create secure PIN hash using PBKDF2-HMAC-SHA256"""
+        """Create secure PIN hash (Argon2id, or PBKDF2-HMAC-SHA256 without argon2-cffi)"""
+        if self._ph is not None:
+            return self._ph.hash(pin)
+        
         salt = secrets.token_bytes(16)
         pin_bytes = pin.encode('utf-8')
         
@@ -328,6 +767,14 @@ class VaultManager:
     
     def _verify_pin_hash(self, pin_hash: str, pin: str) -> bool:
         """Verify PIN against hash"""
+        if pin_hash.startswith('$argon2'):
+            if self._ph is None:
+                return False
+            try:
+                return self._ph.verify(pin_hash, pin)
+            except (VerificationError, InvalidHashError):
+                return False
+        
         try:
             data = base64.urlsafe_b64decode(pin_hash)
             salt = data[:16]
@@ -350,26 +797,31 @@ class VaultManager:
         if not pin or len(pin) < 4:
             return None
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
-        # Check real vault first
         cursor.execute('SELECT pin_hash FROM real_vault_settings LIMIT 1')
         real_row = cursor.fetchone()
-        
-        if real_row and self._verify_pin_hash(real_row[0], pin):
-            conn.close()
-            return 'real'
-        
-        # Check fake vault
         cursor.execute('SELECT pin_hash FROM fake_vault_settings LIMIT 1')
         fake_row = cursor.fetchone()
-        
-        if fake_row and self._verify_pin_hash(fake_row[0], pin):
-            conn.close()
-            return 'fake'
-        
-        conn.close()
+        self._release(conn)
+        
+        # Always run both derivations, even when a vault has no PIN row,
+        # so the time taken doesn't reveal which vault (if any) matched.
+        # They run on the request thread: concurrent logins already spread
+        # across the server's worker threads
+        real_ok = self._verify_pin_hash(real_row[0] if real_row else PLACEHOLDER_PIN_HASH, pin)
+        fake_ok = self._verify_pin_hash(fake_row[0] if fake_row else PLACEHOLDER_PIN_HASH, pin)
+        is_real = bool(real_row) and real_ok
+        is_fake = bool(fake_row) and fake_ok
+        
+        if is_real or is_fake:
+            vault_type = 'real' if is_real else 'fake'
+            matched_hash = real_row[0] if is_real else fake_row[0]
+            if self._ph is not None and not matched_hash.startswith('$argon2'):
+                # Upgrade a PBKDF2 hash now that we know the PIN
+                self.update_pin(vault_type, pin)
+            return vault_type
         return None
     
     def update_pin(self, vault_type: str, new_pin: str) -> bool:
@@ -379,7 +831,7 @@ class VaultManager:
         
         pin_hash = self._hash_pin(new_pin)
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
         if vault_type == 'real':
@@ -393,11 +845,11 @@ class VaultManager:
                 SET pin_hash = ?
             ''', (pin_hash,))
         else:
-            conn.close()
+            self._release(conn)
             return False
         
         conn.commit()
-        conn.close()
+        self._release(conn)
         return True
     
     def setup_initial_pins(self, real_pin: str, fake_pin: str = None) -> bool:
@@ -407,7 +859,7 @@ class VaultManager:
         
         # Generate random fake PIN if not provided
         if not fake_pin:
-            fake_pin = ''.join([str(random.randint(0, 9)) for _ in range(6)])
+            fake_pin = f'{secrets.randbelow(1_000_000):06d}'
         
         # Initialize database with provided PINs
         return self.initialize_database(real_pin, fake_pin)
@@ -415,59 +867,100 @@ class VaultManager:
     def log_auth_attempt(self, attempt_type: str, success: bool, 
                          ip_address: str = None, user_agent: str = None,
                          vault_type: str = None, failure_reason: str = None):
-        """Log authentication attempt"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            INSERT INTO auth_logs 
-            (timestamp, attempt_type, success, ip_address, user_agent, vault_type, failure_reason)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (datetime.now().isoformat(), attempt_type, success, 
-              ip_address, user_agent, vault_type, failure_reason))
+        """Log authentication attempt (queued; written in the background)"""
+        if self._log_thread is None:
+            self._start_log_writer()
         
-        conn.commit()
-        conn.close()
+        self._log_queue.put((datetime.now().isoformat(), attempt_type, success, 
+                             ip_address, user_agent, vault_type, failure_reason))
+    
+    def _start_log_writer(self):
+        """Start the auth log writer thread once"""
+        with self._log_lock:
+            if self._log_thread is not None:
+                return
+            self._log_thread = threading.Thread(target=self._log_writer,
+                                                name='vault-auth-log', daemon=True)
+            self._log_thread.start()
+            atexit.register(self._stop_log_writer)
+    
+    def _log_writer(self):
+        """Drain the auth log queue, flushing every batch or flush interval"""
+        stopping = False
+        while not stopping:
+            rows = [self._log_queue.get()]
+            deadline = time.monotonic() + AUTH_LOG_FLUSH_SECONDS
+            
+            while len(rows) < AUTH_LOG_BATCH_SIZE:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    rows.append(self._log_queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            
+            # None is the shutdown sentinel queued by _stop_log_writer
+            if None in rows:
+                stopping = True
+                rows = [row for row in rows if row is not None]
+            if rows:
+                self._write_auth_logs(rows)
+    
+    def _write_auth_logs(self, rows):
+        """Insert a batch of auth log rows in one transaction"""
+        conn = self._connect()
+        try:
+            conn.executemany('''
+                INSERT INTO auth_logs 
+                (timestamp, attempt_type, success, ip_address, user_agent, vault_type, failure_reason)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Auth log error: {e}")
+        finally:
+            self._release(conn)
+    
+    def _stop_log_writer(self):
+        """Flush queued rows and stop the writer at exit"""
+        self._log_queue.put(None)
+        self._log_thread.join(timeout=2)
     
     def log_failed_attempt(self, ip_address: str):
         """Log failed authentication attempt"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
+        # One atomic upsert: a count older than an hour starts over, and
+        # the attempt after the fifth within the hour blocks for 1 hour
+        block_expiry = datetime.now() + timedelta(hours=1)
         cursor.execute('''
-            SELECT attempts, is_blocked FROM failed_attempts 
-            WHERE ip_address = ? AND last_attempt > datetime('now', '-1 hour')
-        ''', (ip_address,))
-        
-        result = cursor.fetchone()
-        if result:
-            attempts, is_blocked = result
-            if attempts >= 5:
-                # Block for 1 hour
-                block_expiry = datetime.now() + timedelta(hours=1)
-                cursor.execute('''
-                    UPDATE failed_attempts 
-                    SET is_blocked = 1, block_expiry = ?, last_attempt = CURRENT_TIMESTAMP
-                    WHERE ip_address = ?
-                ''', (block_expiry.isoformat(), ip_address))
-            else:
-                cursor.execute('''
-                    UPDATE failed_attempts 
-                    SET attempts = attempts + 1, last_attempt = CURRENT_TIMESTAMP
-                    WHERE ip_address = ?
-                ''', (ip_address,))
-        else:
-            cursor.execute('''
-                INSERT INTO failed_attempts (ip_address, attempts)
-                VALUES (?, 1)
-            ''', (ip_address,))
+            INSERT INTO failed_attempts (ip_address, attempts, last_attempt)
+            VALUES (?, 1, CURRENT_TIMESTAMP)
+            ON CONFLICT(ip_address) DO UPDATE SET
+                attempts = CASE
+                    WHEN last_attempt <= datetime('now', '-1 hour') THEN 1
+                    WHEN attempts >= 5 THEN attempts
+                    ELSE attempts + 1
+                END,
+                is_blocked = CASE
+                    WHEN last_attempt > datetime('now', '-1 hour') AND attempts >= 5 THEN 1
+                    ELSE is_blocked
+                END,
+                block_expiry = CASE
+                    WHEN last_attempt > datetime('now', '-1 hour') AND attempts >= 5 THEN ?
+                    ELSE block_expiry
+                END,
+                last_attempt = CURRENT_TIMESTAMP
+        ''', (ip_address, block_expiry.isoformat()))
         
         conn.commit()
-        conn.close()
+        self._release(conn)
     
     def is_ip_blocked(self, ip_address: str) -> bool:
         """Check if IP is blocked"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -476,7 +969,7 @@ class VaultManager:
         ''', (ip_address,))
         
         result = cursor.fetchone()
-        conn.close()
+        self._release(conn)
         
         if result:
             is_blocked, block_expiry = result
@@ -491,7 +984,7 @@ class VaultManager:
     
     def unblock_ip(self, ip_address: str):
         """Unblock IP address"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -501,55 +994,293 @@ class VaultManager:
         ''', (ip_address,))
         
         conn.commit()
-        conn.close()
+        self._release(conn)
     
-    def encrypt_and_store(self, file_path: str, session_id: str, folder_id: str = 'default'):
-        """Encrypt and store media file"""
-        # Generate unique filename
-        file_ext = Path(file_path).suffix
-        timestamp = int(time.time())
-        unique_name = f"{session_id}_{timestamp}{file_ext}"
+    def encrypt_and_store(self, source, filename: str = None):
+        """Encrypt and store media file
+        
+        source may be a file path or a seekable file-like object (such as an
+        upload stream); it is encrypted in chunks without a temporary copy.
+        """
+        is_path = isinstance(source, (str, os.PathLike))
+        
+        # Random name: no collisions between concurrent uploads, and
+        # nothing about the session (the key material) on disk
+        file_ext = Path(filename or (source if is_path else '')).suffix
+        unique_name = f"{secrets.token_urlsafe(16)}{file_ext}"
+        encrypted_path = os.path.join(self.real_storage, unique_name)
+        thumbnail_path = encrypted_path + '.thumb'
         
         try:
-            # Read file
-            with open(file_path, 'rb') as f:
-                file_data = f.read()
-            
-            # Simple XOR encryption with session_id as key
-            key = hashlib.sha256(session_id.encode()).digest()
-            encrypted_data = self._xor_encrypt(file_data, key)
-            
-            # Save encrypted file
-            encrypted_path = os.path.join(self.real_storage, unique_name)
-            with open(encrypted_path, 'wb') as f:
-                f.write(encrypted_data)
+            # AES-256-GCM with a random key of its own
+            aesgcm = AESGCM(self._new_media_key(encrypted_path))
+            nonce_prefix = secrets.token_bytes(MEDIA_HEADER_SIZE - len(MEDIA_MAGIC))
             
-            # Create thumbnail
-            thumbnail_path = encrypted_path + '.thumb'
-            self._create_thumbnail(file_path, thumbnail_path)
+            src = open(source, 'rb') if is_path else source
+            try:
+                self._advise_sequential(src)
+                with open(encrypted_path, 'wb') as out:
+                    out.write(MEDIA_MAGIC + nonce_prefix)
+                    
+                    # Read one segment ahead so the last one can be marked
+                    index = 0
+                    segment = self._read_segment(src)
+                    while True:
+                        next_segment = self._read_segment(src)
+                        out.write(self._seal_segment(aesgcm, nonce_prefix, index,
+                                                     segment, not next_segment))
+                        if not next_segment:
+                            break
+                        segment = next_segment
+                        index += 1
+                
+                # Create thumbnail from the same source
+                src.seek(0)
+                self._create_thumbnail(src, thumbnail_path)
+            finally:
+                if is_path:
+                    src.close()
             
             # Clean up original
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            if is_path and os.path.exists(source):
+                os.remove(source)
             
             return encrypted_path, thumbnail_path
             
         except Exception as e:
             print(f"Error encrypting file: {e}")
+            # Don't leave a key row and a partial file behind
+            self._secure_delete(encrypted_path)
+            self._unlink_quietly(thumbnail_path)
             return None, None
     
-    def _xor_encrypt(self, data: bytes, key: bytes) -> bytes:
-        """Simple XOR encryption"""
-        key_len = len(key)
-        encrypted = bytearray(len(data))
+    @staticmethod
+    def _advise_sequential(f):
+        """Hint the kernel to read ahead on a file read front to back"""
+        if not hasattr(os, 'posix_fadvise'):
+            return
+        try:
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+            # In-memory uploads and non-regular files have nothing to advise
+            pass
+    
+    def begin_upload(self, session_id: str, filename: str, total_size: int,
+                     folder_id: str = 'default', max_size: int = None) -> dict:
+        """Start a chunked upload and preallocate its encrypted output file"""
+        if total_size <= 0:
+            raise ValueError('Invalid file size')
+        if max_size is not None and total_size > max_size:
+            raise ValueError('File too large')
+        
+        self._discard_stale_uploads()
+        
+        file_ext = Path(filename).suffix
+        unique_name = f"{secrets.token_urlsafe(16)}{file_ext}"
+        encrypted_path = os.path.join(self.real_storage, unique_name)
+        
+        key = self._new_media_key(encrypted_path)
+        nonce_prefix = secrets.token_bytes(MEDIA_HEADER_SIZE - len(MEDIA_MAGIC))
+        with open(encrypted_path, 'wb') as f:
+            f.write(MEDIA_MAGIC + nonce_prefix)
+            f.truncate(self._encrypted_size(total_size))
+        
+        total_parts = (total_size + UPLOAD_CHUNK_SIZE - 1) // UPLOAD_CHUNK_SIZE
+        upload_id = secrets.token_urlsafe(16)
+        
+        with self._uploads_lock:
+            self._uploads[upload_id] = {
+                'session_id': session_id,
+                'filename': filename,
+                'folder_id': folder_id,
+                'encrypted_path': encrypted_path,
+                'key': key,
+                'nonce_prefix': nonce_prefix,
+                'total_size': total_size,
+                'total_parts': total_parts,
+                'received': set(),
+                'created': time.time()
+            }
         
-        for i, byte in enumerate(data):
-            encrypted[i] = byte ^ key[i % key_len]
+        return {
+            'upload_id': upload_id,
+            'chunk_size': UPLOAD_CHUNK_SIZE,
+            'total_parts': total_parts
+        }
+    
+    def _get_upload(self, upload_id: str, session_id: str) -> dict:
+        """Look up an upload owned by this session"""
+        upload = self._uploads.get(upload_id)
+        if upload is None or upload['session_id'] != session_id:
+            raise ValueError('Unknown upload')
+        return upload
+    
+    def write_upload_part(self, upload_id: str, session_id: str, part_number: int,
+                          data: bytes) -> int:
+        """Encrypt one part and write it at its offset; returns parts received
+        
+        Parts may arrive in any order, in parallel, and may be resent.
+        """
+        upload = self._get_upload(upload_id, session_id)
+        
+        if not 0 <= part_number < upload['total_parts']:
+            raise ValueError('Invalid part number')
+        
+        offset = part_number * UPLOAD_CHUNK_SIZE
+        expected = min(UPLOAD_CHUNK_SIZE, upload['total_size'] - offset)
+        if len(data) != expected:
+            raise ValueError(f'Part {part_number} must be {expected} bytes')
+        
+        sealed = self._seal_segment(AESGCM(upload['key']),
+                                    upload['nonce_prefix'], part_number, data,
+                                    part_number == upload['total_parts'] - 1)
+        with open(upload['encrypted_path'], 'r+b') as f:
+            f.seek(MEDIA_HEADER_SIZE + part_number * (MEDIA_SEGMENT_SIZE + MEDIA_TAG_SIZE))
+            f.write(sealed)
+        
+        with self._uploads_lock:
+            upload['received'].add(part_number)
+            return len(upload['received'])
+    
+    def finish_upload(self, upload_id: str, session_id: str):
+        """Complete a chunked upload
+        
+        Returns (upload, thumbnail_path, missing_parts); when parts are
+        missing the upload stays open so the client can resend them.
+        """
+        upload = self._get_upload(upload_id, session_id)
+        
+        missing = sorted(set(range(upload['total_parts'])) - upload['received'])
+        if missing:
+            return upload, None, missing
+        
+        with self._uploads_lock:
+            if self._uploads.pop(upload_id, None) is None:
+                raise ValueError('Unknown upload')
+        
+        # Thumbnails need plaintext: the whole image for images up to
+        # THUMBNAIL_SOURCE_LIMIT, otherwise just the head used by the
+        # simple fallback thumbnail
+        encrypted_path = upload['encrypted_path']
+        segments = self.decrypt_stream(encrypted_path, session_id)
+        if (self._guess_mimetype(upload['filename']).startswith('image/') and
+                upload['total_size'] <= THUMBNAIL_SOURCE_LIMIT):
+            head = b''.join(segments)
+        else:
+            head = next(segments, b'')[:5120]
+            segments.close()
+        
+        thumbnail_path = encrypted_path + '.thumb'
+        self._create_thumbnail(io.BytesIO(head), thumbnail_path)
+        
+        return upload, thumbnail_path, []
+    
+    def _discard_stale_uploads(self):
+        """Drop uploads that were never finished, along with their partial files"""
+        cutoff = time.time() - UPLOAD_TTL_SECONDS
+        
+        with self._uploads_lock:
+            stale = [upload_id for upload_id, upload in self._uploads.items()
+                     if upload['created'] < cutoff]
+            stale_uploads = [self._uploads.pop(upload_id) for upload_id in stale]
+        
+        for upload in stale_uploads:
+            self._secure_delete(upload['encrypted_path'])
+    
+    def _new_media_key(self, encrypted_path: str) -> bytes:
+        """Generate and record the AES-256 key for a new media file"""
+        key = AESGCM.generate_key(bit_length=256)
+        
+        conn = self._connect()
+        conn.execute('INSERT INTO media_keys (encrypted_path, key) VALUES (?, ?)',
+                     (encrypted_path, key))
+        conn.commit()
+        self._release(conn)
+        return key
+    
+    def _file_key(self, encrypted_path: str, session_id: str) -> bytes:
+        """Key of an AES-GCM media file, falling back to the session key
+        for files stored before per-file keys"""
+        conn = self._connect()
+        cursor = conn.cursor()
+        cursor.execute('SELECT key FROM media_keys WHERE encrypted_path = ?',
+                       (encrypted_path,))
+        row = cursor.fetchone()
+        self._release(conn)
+        return row[0] if row else self._media_key(session_id)
+    
+    def _shred_media_key(self, encrypted_path: str) -> bool:
+        """Destroy a file's key; returns False if it had none (older files)"""
+        conn = self._connect()
+        cursor = conn.cursor()
+        # Zero the key in place before dropping the row, so the freed page
+        # doesn't keep it
+        cursor.execute('UPDATE media_keys SET key = zeroblob(32) WHERE encrypted_path = ?',
+                       (encrypted_path,))
+        cursor.execute('DELETE FROM media_keys WHERE encrypted_path = ?', (encrypted_path,))
+        shredded = cursor.rowcount > 0
+        conn.commit()
+        self._release(conn)
+        return shredded
+    
+    def _media_key(self, session_id: str) -> bytes:
+        """Derive the AES-256 media key for a session
         
-        return bytes(encrypted)
+        Session ids are 256-bit random tokens, so one BLAKE2b call is
+        enough; there is no low-entropy secret to stretch.
+        """
+        return _session_media_key(session_id)
+    
+    def _encrypted_size(self, plain_size: int) -> int:
+        """Size of a media file holding plain_size bytes"""
+        segments = max(1, -(-plain_size // MEDIA_SEGMENT_SIZE))
+        return MEDIA_HEADER_SIZE + plain_size + segments * MEDIA_TAG_SIZE
+    
+    def plaintext_size(self, encrypted_path: str) -> int:
+        """Size of the decrypted contents of a media file"""
+        size = os.path.getsize(encrypted_path)
+        with open(encrypted_path, 'rb') as f:
+            if f.read(len(MEDIA_MAGIC)) != MEDIA_MAGIC:
+                return size
+        
+        sealed_size = size - MEDIA_HEADER_SIZE
+        segments = max(1, -(-sealed_size // (MEDIA_SEGMENT_SIZE + MEDIA_TAG_SIZE)))
+        return sealed_size - segments * MEDIA_TAG_SIZE
+    
+    def _read_segment(self, f) -> bytes:
+        """Read a full segment of plaintext, short only at end of file"""
+        segment = f.read(MEDIA_SEGMENT_SIZE)
+        while segment and len(segment) < MEDIA_SEGMENT_SIZE:
+            more = f.read(MEDIA_SEGMENT_SIZE - len(segment))
+            if not more:
+                break
+            segment += more
+        return segment
+    
+    def _seal_segment(self, aesgcm, nonce_prefix: bytes, index: int,
+                      data: bytes, last: bool) -> bytes:
+        """Encrypt one segment; returns ciphertext + tag"""
+        nonce = nonce_prefix + index.to_bytes(4, 'big')
+        return aesgcm.encrypt(nonce, data, b'\x01' if last else b'\x00')
     
-    def _create_thumbnail(self, image_path: str, thumbnail_path: str, size: tuple = (200, 200)):
-        """Create thumbnail for image"""
+    def _xor_encrypt(self, data: bytes, key: bytes) -> bytes:
+        """Simple XOR encryption, applied to the whole buffer at once"""
+        size = len(data)
+        if not size:
+            return b''
+        
+        repeats = -(-size // len(key))
+        if NUMPY_AVAILABLE:
+            stream = np.tile(np.frombuffer(key, dtype=np.uint8), repeats)[:size]
+            return (np.frombuffer(data, dtype=np.uint8) ^ stream).tobytes()
+        
+        # Without numpy, XOR as two big integers; still one C-level pass
+        stream = (key * repeats)[:size]
+        return (int.from_bytes(data, 'little') ^
+                int.from_bytes(stream, 'little')).to_bytes(size, 'little')
+    
+    def _create_thumbnail(self, image_path, thumbnail_path: str, size: tuple = (200, 200)):
+        """Create thumbnail for image (path or seekable file object)"""
         try:
             from PIL import Image
             
@@ -565,15 +1296,13 @@ class VaultManager:
                 # Create thumbnail
                 img.thumbnail(size)
                 
-                # Save thumbnail
-                img.save(thumbnail_path, 'JPEG', quality=85)
+                # Encode in memory, so the plaintext thumbnail never
+                # touches disk and the file is written only once
+                buffer = io.BytesIO()
+                img.save(buffer, 'JPEG', quality=85)
                 
                 # Encrypt thumbnail
-                with open(thumbnail_path, 'rb') as f:
-                    thumb_data = f.read()
-                
-                key = hashlib.sha256(b'thumbnail_key').digest()
-                encrypted_thumb = self._xor_encrypt(thumb_data, key)
+                encrypted_thumb = self._xor_encrypt(buffer.getbuffer(), _THUMBNAIL_KEY)
                 
                 with open(thumbnail_path, 'wb') as f:
                     f.write(encrypted_thumb)
@@ -588,15 +1317,18 @@ class VaultManager:
             print(f"Thumbnail creation failed: {e}")
             return self._create_simple_thumbnail(image_path, thumbnail_path)
     
-    def _create_simple_thumbnail(self, image_path: str, thumbnail_path: str):
+    def _create_simple_thumbnail(self, image_path, thumbnail_path: str):
         """Create simple thumbnail (fallback)"""
         try:
             # Copy first 5KB as "thumbnail"
-            with open(image_path, 'rb') as f:
-                data = f.read(5120)
+            if isinstance(image_path, (str, os.PathLike)):
+                with open(image_path, 'rb') as f:
+                    data = f.read(5120)
+            else:
+                image_path.seek(0)
+                data = image_path.read(5120)
             
-            key = hashlib.sha256(b'thumbnail_key').digest()
-            encrypted_data = self._xor_encrypt(data, key)
+            encrypted_data = self._xor_encrypt(data, _THUMBNAIL_KEY)
             
             with open(thumbnail_path, 'wb') as f:
                 f.write(encrypted_data)
@@ -612,85 +1344,49 @@ class VaultManager:
             return None
         
         # Get file info
-        file_size = os.path.getsize(encrypted_path)
+        file_size = self.plaintext_size(encrypted_path)
         mimetype = self._guess_mimetype(filename)
+        thumbnail_exists = bool(thumbnail_path) and os.path.exists(thumbnail_path)
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
         if vault_type == 'real':
             cursor.execute('''
                 INSERT INTO real_media 
                 (filename, original_filename, encrypted_path, thumbnail_path, 
-                 folder_id, file_size, mimetype, upload_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                 thumbnail_exists, folder_id, file_size, mimetype, upload_date)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
             ''', (filename, filename, encrypted_path, thumbnail_path, 
-                  folder_id, file_size, mimetype))
+                  thumbnail_exists, folder_id, file_size, mimetype))
         else:
             cursor.execute('''
                 INSERT INTO fake_media 
-                (filename, encrypted_path, thumbnail_path, folder_id, file_size, mimetype)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (filename, encrypted_path, thumbnail_path, folder_id, file_size, mimetype))
+                (filename, encrypted_path, thumbnail_path, thumbnail_exists, folder_id, file_size, mimetype)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (filename, encrypted_path, thumbnail_path, thumbnail_exists, folder_id, file_size, mimetype))
         
         media_id = cursor.lastrowid
         conn.commit()
-        conn.close()
+        self._release(conn)
         
         return media_id
     
+    @staticmethod
+    def _fetch_dicts(cursor) -> list:
+        """Rows of an executed query as dicts, built straight from the tuples"""
+        columns = [col[0] for col in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+    
     def _guess_mimetype(self, filename: str) -> str:
         """Guess mimetype from filename"""
-        ext = Path(filename).suffix.lower()
-        
-        mime_types = {
-            # Images
-            '.jpg': 'image/jpeg',
-            '.jpeg': 'image/jpeg',
-            '.png': 'image/png',
-            '.gif': 'image/gif',
-            '.bmp': 'image/bmp',
-            '.webp': 'image/webp',
-            '.tiff': 'image/tiff',
-            '.ico': 'image/x-icon',
-            
-            # Videos
-            '.mp4': 'video/mp4',
-            '.mov': 'video/quicktime',
-            '.avi': 'video/x-msvideo',
-            '.mkv': 'video/x-matroska',
-            '.webm': 'video/webm',
-            '.flv': 'video/x-flv',
-            '.wmv': 'video/x-ms-wmv',
-            '.m4v': 'video/x-m4v',
-            '.3gp': 'video/3gpp',
-            
-            # Audio
-            '.mp3': 'audio/mpeg',
-            '.wav': 'audio/wav',
-            '.ogg': 'audio/ogg',
-            '.m4a': 'audio/mp4',
-            '.flac': 'audio/flac',
-            
-            # Documents
-            '.pdf': 'application/pdf',
-            '.txt': 'text/plain',
-            '.md': 'text/markdown',
-            '.doc': 'application/msword',
-            '.docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-            '.xls': 'application/vnd.ms-excel',
-            '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            '.ppt': 'application/vnd.ms-powerpoint',
-            '.pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
-        }
-        
-        return mime_types.get(ext, 'application/octet-stream')
+        ext = os.path.splitext(filename)[1].lower()
+        return MIME_TYPES.get(ext, 'application/octet-stream')
     
     def get_media_list(self, vault_type: str, folder_id: str = 'default', 
                       include_hidden: bool = False, limit: int = None):
         """Get list of media files"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        conn = self._connect()
         cursor = conn.cursor()
         
         if vault_type == 'real':
@@ -702,34 +1398,31 @@ class VaultManager:
             '''
             if not include_hidden:
                 query += ' AND is_hidden = 0'
-            query += ' ORDER BY upload_date DESC'
+            # LIMIT -1 means no limit, so the SQL text is the same either way
+            query += ' ORDER BY upload_date DESC LIMIT ?'
             
-            if limit:
-                query += f' LIMIT {limit}'
-            
-            cursor.execute(query, (folder_id,))
+            cursor.execute(query, (folder_id, limit or -1))
         else:
             query = '''
                 SELECT id, filename, thumbnail_path, upload_date, file_size, mimetype, folder_id
                 FROM fake_media
                 WHERE folder_id = ?
                 ORDER BY upload_date DESC
+                LIMIT ?
             '''
-            if limit:
-                query += f' LIMIT {limit}'
             
-            cursor.execute(query, (folder_id,))
+            cursor.execute(query, (folder_id, limit or -1))
         
-        media_list = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        media_list = self._fetch_dicts(cursor)
+        self._release(conn)
         
         return media_list
     
     def get_media_info(self, media_id: int, vault_type: str):
         """Get media file information"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        conn = self._connect()
         cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
         
         if vault_type == 'real':
             cursor.execute('SELECT * FROM real_media WHERE id = ?', (media_id,))
@@ -737,7 +1430,7 @@ class VaultManager:
             cursor.execute('SELECT * FROM fake_media WHERE id = ?', (media_id,))
         
         result = cursor.fetchone()
-        conn.close()
+        self._release(conn)
         
         return dict(result) if result else None
     
@@ -746,64 +1439,91 @@ class VaultManager:
         if not os.path.exists(encrypted_path):
             return None
         
+        temp_path = f'temp_{secrets.token_urlsafe(12)}.tmp'
         try:
-            with open(encrypted_path, 'rb') as f:
-                encrypted_data = f.read()
-            
-            # Decrypt using session_id as key
-            key = hashlib.sha256(session_id.encode()).digest()
-            decrypted_data = self._xor_encrypt(encrypted_data, key)
-            
             # Create temporary file for serving
-            temp_path = f'temp_{int(time.time())}_{secrets.token_hex(8)}.tmp'
             with open(temp_path, 'wb') as f:
-                f.write(decrypted_data)
+                for chunk in self.decrypt_stream(encrypted_path, session_id):
+                    f.write(chunk)
             
             return temp_path
             
         except Exception as e:
             print(f"Error decrypting file: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
             return None
     
+    def decrypt_stream(self, encrypted_path: str, session_id: str):
+        """Yield decrypted media in chunks without writing plaintext to disk
+        
+        Raises cryptography's InvalidTag if a segment was tampered with.
+        """
+        with open(encrypted_path, 'rb') as f:
+            header = f.read(MEDIA_HEADER_SIZE)
+            
+            if not header.startswith(MEDIA_MAGIC):
+                # Legacy XOR format
+                key = _legacy_session_key(session_id)
+                chunk = header
+                while chunk:
+                    chunk += f.read(STREAM_CHUNK_SIZE - len(chunk))
+                    yield self._xor_encrypt(chunk, key)
+                    chunk = f.read(STREAM_CHUNK_SIZE)
+                return
+            
+            aesgcm = AESGCM(self._file_key(encrypted_path, session_id))
+            nonce_prefix = header[len(MEDIA_MAGIC):]
+            end = os.fstat(f.fileno()).st_size
+            
+            index = 0
+            while True:
+                sealed = f.read(MEDIA_SEGMENT_SIZE + MEDIA_TAG_SIZE)
+                last = f.tell() >= end
+                nonce = nonce_prefix + index.to_bytes(4, 'big')
+                yield aesgcm.decrypt(nonce, sealed, b'\x01' if last else b'\x00')
+                if last:
+                    break
+                index += 1
+    
     def delete_media(self, media_id: int, vault_type: str, permanent: bool = False, 
                     reason: str = None) -> bool:
         """Delete media file"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get file info before deletion
-        if vault_type == 'real':
-            cursor.execute('''
-                SELECT encrypted_path, thumbnail_path FROM real_media 
-                WHERE id = ? AND is_deleted = 0
-            ''', (media_id,))
-        else:
-            cursor.execute('''
-                SELECT encrypted_path, thumbnail_path FROM fake_media 
-                WHERE id = ?
-            ''', (media_id,))
-        
-        result = cursor.fetchone()
-        if not result:
-            conn.close()
-            return False
+        if not permanent and vault_type == 'real':
+            # Read before the transaction; get_setting shares the connection
+            expiry_days = self.get_setting('recycle_bin_expiry_days', 7)
         
-        encrypted_path, thumbnail_path = result
+        conn = self._connect()
+        remove_files = []
         
-        if permanent:
-            # Permanent deletion
+        with self._transaction(conn) as cursor:
+            # Get file info before deletion
             if vault_type == 'real':
-                cursor.execute('DELETE FROM real_media WHERE id = ?', (media_id,))
+                cursor.execute('''
+                    SELECT encrypted_path, thumbnail_path FROM real_media 
+                    WHERE id = ? AND is_deleted = 0
+                ''', (media_id,))
             else:
-                cursor.execute('DELETE FROM fake_media WHERE id = ?', (media_id,))
+                cursor.execute('''
+                    SELECT encrypted_path, thumbnail_path FROM fake_media 
+                    WHERE id = ?
+                ''', (media_id,))
             
-            # Delete files
-            for path in [encrypted_path, thumbnail_path]:
-                if path and os.path.exists(path):
-                    self._secure_delete(path)
-        else:
-            # Move to recycle bin (real vault only)
-            if vault_type == 'real':
+            result = cursor.fetchone()
+            if not result:
+                return False
+            
+            encrypted_path, thumbnail_path = result
+            
+            if permanent:
+                # Permanent deletion
+                if vault_type == 'real':
+                    cursor.execute('DELETE FROM real_media WHERE id = ?', (media_id,))
+                else:
+                    cursor.execute('DELETE FROM fake_media WHERE id = ?', (media_id,))
+                remove_files = [encrypted_path, thumbnail_path]
+            elif vault_type == 'real':
+                # Move to recycle bin (real vault only)
                 cursor.execute('''
                     UPDATE real_media 
                     SET is_deleted = 1, deletion_date = CURRENT_TIMESTAMP
@@ -811,7 +1531,6 @@ class VaultManager:
                 ''', (media_id,))
                 
                 # Add to recycle bin
-                expiry_days = self.get_setting('recycle_bin_expiry_days', 7)
                 auto_delete_at = datetime.now() + timedelta(days=int(expiry_days))
                 
                 cursor.execute('''
@@ -822,28 +1541,33 @@ class VaultManager:
             else:
                 # For fake vault, just delete
                 cursor.execute('DELETE FROM fake_media WHERE id = ?', (media_id,))
-                if encrypted_path and os.path.exists(encrypted_path):
-                    os.remove(encrypted_path)
-                if thumbnail_path and os.path.exists(thumbnail_path):
-                    os.remove(thumbnail_path)
+                remove_files = [encrypted_path, thumbnail_path]
+        
+        # Files go only once the rows are gone for good
+        for path in remove_files:
+            if not path:
+                continue
+            if permanent:
+                self._secure_delete(path)
+            else:
+                self._shred_media_key(path)
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
         
-        conn.commit()
-        conn.close()
+        self._release(conn)
         return True
     
     def restore_media(self, media_id: int) -> bool:
         """Restore media from recycle bin"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
-        # Check if in recycle bin
-        cursor.execute('''
-            SELECT media_id, vault_type FROM recycle_bin 
-            WHERE media_id = ?
-        ''', (media_id,))
-        
-        if not cursor.fetchone():
-            conn.close()
+        # Remove from recycle bin; nothing removed means it wasn't there
+        cursor.execute('DELETE FROM recycle_bin WHERE media_id = ?', (media_id,))
+        if cursor.rowcount == 0:
+            self._release(conn)
             return False
         
         # Restore media
@@ -853,28 +1577,41 @@ class VaultManager:
             WHERE id = ?
         ''', (media_id,))
         
-        # Remove from recycle bin
-        cursor.execute('DELETE FROM recycle_bin WHERE media_id = ?', (media_id,))
-        
         conn.commit()
-        conn.close()
+        self._release(conn)
         return True
     
-    def _secure_delete(self, file_path: str, passes: int = 3):
-        """Securely delete file by overwriting"""
-        if not os.path.exists(file_path):
-            return
-        
+    def _secure_delete(self, file_path: str, passes: int = 1):
+        """Securely delete file
+        
+        Media with a per-file key is crypto-shredded: destroying the key is
+        enough, so the file is just unlinked. Anything else is overwritten
+        first on spinning disks; on SSDs an overwrite lands on different
+        flash pages (wear leveling), so it only costs writes.
+        """
         try:
-            file_size = os.path.getsize(file_path)
-            
-            for i in range(passes):
-                # Overwrite with random data
-                with open(file_path, 'wb') as f:
-                    f.write(secrets.token_bytes(file_size))
+            # Files without a key of their own have to be overwritten
+            if not self._shred_media_key(file_path):
+                st = os.stat(file_path)
+                if not _device_is_solid_state(st.st_dev):
+                    # Overwrite in place ('r+b' doesn't truncate, which would
+                    # free the old blocks instead of overwriting them)
+                    chunk = MEDIA_SEGMENT_SIZE
+                    with open(file_path, 'r+b') as f:
+                        for _ in range(passes):
+                            f.seek(0)
+                            remaining = st.st_size
+                            while remaining > 0:
+                                n = min(chunk, remaining)
+                                f.write(os.urandom(n))
+                                remaining -= n
+                            f.flush()
+                            os.fsync(f.fileno())
             
             # Delete file
             os.remove(file_path)
+        except FileNotFoundError:
+            pass
         except Exception as e:
             print(f"Secure delete failed: {e}")
             try:
@@ -884,10 +1621,10 @@ class VaultManager:
     
     def create_folder(self, name: str, vault_type: str, parent_id: str = None) -> str:
         """Create new folder"""
-        # Generate folder ID
-        folder_id = hashlib.md5(f"{name}_{vault_type}_{time.time()}".encode()).hexdigest()
+        # Generate folder ID (same 32 hex digits as before)
+        folder_id = secrets.token_hex(16)
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
         cursor.execute('''
@@ -896,14 +1633,13 @@ class VaultManager:
         ''', (folder_id, name, vault_type, parent_id))
         
         conn.commit()
-        conn.close()
+        self._release(conn)
         
         return folder_id
     
     def get_folders(self, vault_type: str, parent_id: str = None):
         """Get list of folders"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        conn = self._connect()
         cursor = conn.cursor()
         
         if parent_id:
@@ -921,54 +1657,45 @@ class VaultManager:
                 ORDER BY sort_order, name
             ''', (vault_type,))
         
-        folders = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        folders = self._fetch_dicts(cursor)
+        self._release(conn)
         
         return folders
     
     def update_folder(self, folder_id: str, name: str = None, color: str = None, 
                      icon: str = None, sort_order: int = None):
         """Update folder information"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
-        updates = []
-        params = []
-        
-        if name is not None:
-            updates.append("name = ?")
-            params.append(name)
-        if color is not None:
-            updates.append("color = ?")
-            params.append(color)
-        if icon is not None:
-            updates.append("icon = ?")
-            params.append(icon)
-        if sort_order is not None:
-            updates.append("sort_order = ?")
-            params.append(sort_order)
-        
-        if updates:
-            updates.append("updated_at = CURRENT_TIMESTAMP")
-            params.append(folder_id)
-            
-            query = f"UPDATE folders SET {', '.join(updates)} WHERE id = ?"
-            cursor.execute(query, params)
+        fields = (name, color, icon, sort_order)
+        if any(value is not None for value in fields):
+            # One fixed statement (so it stays in the statement cache);
+            # NULL keeps a column's current value
+            cursor.execute('''
+                UPDATE folders SET
+                    name = COALESCE(?, name),
+                    color = COALESCE(?, color),
+                    icon = COALESCE(?, icon),
+                    sort_order = COALESCE(?, sort_order),
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', (*fields, folder_id))
         
         conn.commit()
-        conn.close()
+        self._release(conn)
         return True
     
     def delete_folder(self, folder_id: str, move_to_default: bool = True):
         """Delete folder"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
-        # Get vault type
-        cursor.execute('SELECT vault_type FROM folders WHERE id = ?', (folder_id,))
+        # Delete folder, learning its vault type in the same statement
+        cursor.execute('DELETE FROM folders WHERE id = ? RETURNING vault_type', (folder_id,))
         result = cursor.fetchone()
         if not result:
-            conn.close()
+            self._release(conn)
             return False
         
         vault_type = result[0]
@@ -988,16 +1715,13 @@ class VaultManager:
                     WHERE folder_id = ?
                 ''', (folder_id,))
         
-        # Delete folder
-        cursor.execute('DELETE FROM folders WHERE id = ?', (folder_id,))
-        
         conn.commit()
-        conn.close()
+        self._release(conn)
         return True
     
     def update_settings(self, settings: dict):
         """Update vault settings"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
         for key, value in settings.items():
@@ -1008,27 +1732,28 @@ class VaultManager:
                     UPDATE real_vault_settings 
                     SET pin_hash = ?, updated_at = CURRENT_TIMESTAMP
                 ''', (pin_hash,))
-            elif key in ['fingerprint_enabled', 'auto_lock_minutes', 'stealth_mode', 'decoy_mode']:
-                cursor.execute(f'''
-                    UPDATE real_vault_settings 
-                    SET {key} = ?, updated_at = CURRENT_TIMESTAMP
-                ''', (value,))
+            elif key in VAULT_SETTING_UPDATES:
+                cursor.execute(VAULT_SETTING_UPDATES[key], (value,))
             else:
-                # Store in app_settings
+                # Store in app_settings, with its type; keeps the category
                 cursor.execute('''
-                    INSERT OR REPLACE INTO app_settings (key, value, updated_at)
-                    VALUES (?, ?, CURRENT_TIMESTAMP)
-                ''', (key, str(value)))
+                    INSERT INTO app_settings (key, value, type, updated_at)
+                    VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+                    ON CONFLICT(key) DO UPDATE SET
+                        value = excluded.value,
+                        type = excluded.type,
+                        updated_at = excluded.updated_at
+                ''', (key, *self._encode_setting(value)))
         
         conn.commit()
-        conn.close()
+        self._release(conn)
         return True
     
     def get_settings(self):
         """Get all settings"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        conn = self._connect()
         cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
         
         # Get real vault settings
         cursor.execute('SELECT * FROM real_vault_settings LIMIT 1')
@@ -1042,30 +1767,65 @@ class VaultManager:
                 del settings['pin_hash']
         
         # Get app settings
-        cursor.execute('SELECT key, value FROM app_settings')
+        cursor.execute('SELECT key, value, type FROM app_settings')
         app_settings = cursor.fetchall()
         
-        for key, value in app_settings:
-            # Try to convert to appropriate type
-            if value.isdigit():
-                settings[key] = int(value)
-            elif value.lower() in ['true', 'false']:
-                settings[key] = value.lower() == 'true'
-            else:
-                settings[key] = value
+        for key, value, value_type in app_settings:
+            settings[key] = self._coerce_setting(value, value_type)
         
-        conn.close()
+        self._release(conn)
         return settings
     
     def get_setting(self, key: str, default=None):
         """Get specific setting"""
-        settings = self.get_settings()
-        return settings.get(key, default)
+        conn = self._connect()
+        cursor = conn.cursor()
+        
+        # App settings take precedence, as in get_settings()
+        cursor.execute('SELECT value, type FROM app_settings WHERE key = ?', (key,))
+        row = cursor.fetchone()
+        if row:
+            self._release(conn)
+            return self._coerce_setting(*row)
+        
+        row = None
+        if key in VAULT_SETTING_COLUMNS:
+            cursor.execute(f'SELECT {key} FROM real_vault_settings LIMIT 1')
+            row = cursor.fetchone()
+        self._release(conn)
+        
+        return row[0] if row else default
+    
+    @staticmethod
+    def _encode_setting(value):
+        """Text and type under which an app setting value is stored"""
+        if isinstance(value, bool):
+            return ('true' if value else 'false'), 'bool'
+        if isinstance(value, int):
+            return str(value), 'int'
+        if isinstance(value, str):
+            return value, 'str'
+        return json.dumps(value), 'json'
+    
+    @staticmethod
+    def _infer_setting_type(value: str) -> str:
+        """Guess the type of a setting stored before types were recorded"""
+        if value.isdigit():
+            return 'int'
+        if value.lower() in ['true', 'false']:
+            return 'bool'
+        return 'str'
+    
+    def _coerce_setting(self, value: str, value_type: str = None):
+        """Convert a stored app setting to its recorded type"""
+        decode = SETTING_DECODERS.get(value_type)
+        if decode is None:
+            decode = SETTING_DECODERS[self._infer_setting_type(value)]
+        return decode(value)
     
     def get_security_logs(self, limit: int = 100, vault_type: str = None):
         """Get security logs"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
+        conn = self._connect()
         cursor = conn.cursor()
         
         if vault_type:
@@ -1082,8 +1842,8 @@ class VaultManager:
                 LIMIT ?
             ''', (limit,))
         
-        logs = [dict(row) for row in cursor.fetchall()]
-        conn.close()
+        logs = self._fetch_dicts(cursor)
+        self._release(conn)
         
         return logs
     
@@ -1091,142 +1851,174 @@ class VaultManager:
                          max_views: int = 1, password: str = None):
         """Create temporary share link"""
         token = secrets.token_urlsafe(32)
-        expiry_time = datetime.now() + timedelta(hours=expiry_hours)
+        if max_views is not None:
+            max_views = int(max_views)
+        # Computed by SQLite in UTC, like the CURRENT_TIMESTAMP it is
+        # compared against (datetime.now() was local time)
+        expiry_modifier = f'{expiry_hours:+} hours'
         
         password_hash = None
         if password:
             password_hash = self._hash_pin(password)
         
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
         cursor.execute('''
             INSERT INTO share_links 
             (token, media_id, expiry_time, max_views, password_hash)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (token, media_id, expiry_time, max_views, password_hash))
+            VALUES (?, ?, datetime('now', ?), ?, ?)
+        ''', (token, media_id, expiry_modifier, max_views, password_hash))
         
         conn.commit()
-        conn.close()
+        self._release(conn)
         
         return token
     
     def access_share_link(self, token: str):
         """Access shared media"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
-        cursor.execute('''
-            SELECT s.*, m.encrypted_path, m.filename, m.mimetype
-            FROM share_links s
-            JOIN real_media m ON s.media_id = m.id
-            WHERE s.token = ? AND s.expiry_time > CURRENT_TIMESTAMP
-        ''', (token,))
-        
-        result = cursor.fetchone()
-        if not result:
-            conn.close()
-            return None
-        
-        # Update view count
+        # Check and count the view in one statement, so concurrent requests
+        # can't both take a link's last view
         cursor.execute('''
             UPDATE share_links 
             SET view_count = view_count + 1, last_accessed = CURRENT_TIMESTAMP
-            WHERE token = ?
+            WHERE token = ? AND expiry_time > CURRENT_TIMESTAMP
+              AND (max_views IS NULL OR max_views <= 0 OR view_count < max_views)
+            RETURNING media_id
         ''', (token,))
         
+        row = cursor.fetchone()
+        result = None
+        if row:
+            cursor.execute('''
+                SELECT encrypted_path, filename, mimetype
+                FROM real_media WHERE id = ?
+            ''', (row[0],))
+            result = cursor.fetchone()
+        
         conn.commit()
-        conn.close()
+        self._release(conn)
         
-        # Decrypt the file temporarily
         if result:
             return {
-                'path': result[10],  # encrypted_path
-                'filename': result[11],  # filename
-                'mimetype': result[12]  # mimetype
+                'path': result[0],  # encrypted_path
+                'filename': result[1],  # filename
+                'mimetype': result[2]  # mimetype
             }
         return None
     
-    def cleanup_expired_shares(self):
-        """Clean up expired share links"""
-        conn = sqlite3.connect(self.db_path)
+    def cleanup_expired_shares(self, limit: int = -1):
+        """Clean up expired share links (at most limit of them; -1 for all)"""
+        conn = self._connect()
         cursor = conn.cursor()
         
         cursor.execute('''
             DELETE FROM share_links 
-            WHERE expiry_time <= CURRENT_TIMESTAMP
-        ''')
+            WHERE rowid IN (
+                SELECT rowid FROM share_links 
+                WHERE expiry_time <= CURRENT_TIMESTAMP
+                LIMIT ?
+            )
+        ''', (limit,))
         
         deleted = cursor.rowcount
         conn.commit()
-        conn.close()
+        self._release(conn)
         
         return deleted
     
-    def cleanup_recycle_bin(self):
-        """Permanently delete items from recycle bin"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Get items ready for permanent deletion
-        cursor.execute('''
-            SELECT rb.media_id, rb.original_path
-            FROM recycle_bin rb
-            WHERE rb.auto_delete_at <= CURRENT_TIMESTAMP
-        ''')
-        
-        items_to_delete = cursor.fetchall()
-        deleted = 0
-        
-        for media_id, original_path in items_to_delete:
-            # Permanent delete from media table
-            cursor.execute('DELETE FROM real_media WHERE id = ?', (media_id,))
+    def cleanup_recycle_bin(self, limit: int = -1):
+        """Permanently delete items from recycle bin (at most limit; -1 for all)"""
+        # The same ordered subquery (oldest first, off the index) picks the
+        # expired items in each statement; the write lock keeps the set
+        # stable between them
+        expired = '''
+            SELECT id FROM recycle_bin
+            WHERE auto_delete_at <= CURRENT_TIMESTAMP
+            ORDER BY auto_delete_at
+            LIMIT ?
+        '''
+        
+        conn = self._connect()
+        
+        with self._transaction(conn) as cursor:
+            cursor.execute(f'SELECT original_path FROM recycle_bin WHERE id IN ({expired})', (limit,))
+            paths = [row[0] for row in cursor.fetchall()]
             
-            # Delete the file
-            if original_path and os.path.exists(original_path):
-                try:
-                    os.remove(original_path)
-                except:
-                    pass
+            # Crypto-shred the files' keys along with their rows
+            purged = f'SELECT original_path FROM recycle_bin WHERE id IN ({expired})'
+            cursor.execute(f'''
+                UPDATE media_keys SET key = zeroblob(32)
+                WHERE encrypted_path IN ({purged})
+            ''', (limit,))
+            cursor.execute(f'''
+                DELETE FROM media_keys WHERE encrypted_path IN ({purged})
+                RETURNING encrypted_path
+            ''', (limit,))
+            shredded = {row[0] for row in cursor.fetchall()}
             
-            # Delete from recycle bin
-            cursor.execute('DELETE FROM recycle_bin WHERE media_id = ?', (media_id,))
-            deleted += 1
+            # Permanent delete from media table, then from recycle bin
+            cursor.execute(f'''
+                DELETE FROM real_media
+                WHERE id IN (SELECT media_id FROM recycle_bin WHERE id IN ({expired}))
+            ''', (limit,))
+            cursor.execute(f'DELETE FROM recycle_bin WHERE id IN ({expired})', (limit,))
         
-        conn.commit()
-        conn.close()
+        self._release(conn)
         
-        return deleted
+        # Delete the files once the rows are gone. Shredded files just need
+        # unlinking; older files without a key are overwritten first
+        for original_path in paths:
+            if original_path in shredded:
+                self._unlink_quietly(original_path)
+            elif original_path:
+                self._secure_delete(original_path)
+        
+        return len(paths)
+    
+    @staticmethod
+    def _unlink_quietly(path: str):
+        """Remove a file, ignoring one that is already gone or can't be removed"""
+        try:
+            os.remove(path)
+        except OSError:
+            pass
     
     def get_storage_stats(self, vault_type: str):
         """Get storage statistics"""
-        conn = sqlite3.connect(self.db_path)
+        conn = self._connect()
         cursor = conn.cursor()
         
+        # Counts come from vault_stats; the dates are separate MIN/MAX
+        # subqueries so each is a single index probe
         if vault_type == 'real':
             cursor.execute('''
                 SELECT 
-                    COUNT(*) as file_count,
-                    SUM(file_size) as total_size,
-                    COUNT(DISTINCT folder_id) as folder_count,
-                    MIN(upload_date) as oldest_file,
-                    MAX(upload_date) as newest_file
-                FROM real_media 
-                WHERE is_deleted = 0
+                    s.file_count,
+                    s.total_size,
+                    (SELECT COUNT(DISTINCT folder_id) FROM real_media WHERE is_deleted = 0),
+                    (SELECT MIN(upload_date) FROM real_media WHERE is_deleted = 0),
+                    (SELECT MAX(upload_date) FROM real_media WHERE is_deleted = 0)
+                FROM vault_stats s
+                WHERE s.vault_type = 'real'
             ''')
         else:
             cursor.execute('''
                 SELECT 
-                    COUNT(*) as file_count,
-                    SUM(file_size) as total_size,
-                    COUNT(DISTINCT folder_id) as folder_count,
-                    MIN(upload_date) as oldest_file,
-                    MAX(upload_date) as newest_file
-                FROM fake_media
+                    s.file_count,
+                    s.total_size,
+                    (SELECT COUNT(DISTINCT folder_id) FROM fake_media),
+                    (SELECT MIN(upload_date) FROM fake_media),
+                    (SELECT MAX(upload_date) FROM fake_media)
+                FROM vault_stats s
+                WHERE s.vault_type = 'fake'
             ''')
         
         result = cursor.fetchone()
-        conn.close()
+        self._release(conn)
         
         if result:
             return {
@@ -1255,36 +2047,29 @@ class VaultManager:
             'recipe.txt'
         ]
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        
-        # Check if fake media already exists
-        cursor.execute('SELECT COUNT(*) FROM fake_media')
-        count = cursor.fetchone()[0]
-        
-        if count > 0:
-            conn.close()
-            return
-        
-        # Add fake media entries
-        for filename in fake_files:
-            fake_path = os.path.join(self.fake_storage, filename)
-            file_size = random.randint(1024, 1024 * 1024)  # 1KB to 1MB
+        rows = [(filename,
+                 os.path.join(self.fake_storage, filename),
+                 os.path.join(self.fake_storage, filename) + '.thumb',
+                 'default',
+                 random.randint(1024, 1024 * 1024),  # 1KB to 1MB
+                 self._guess_mimetype(filename),
+                 random.randint(0, 30))  # Random date in last 30 days
+                for filename in fake_files]
+        
+        conn = self._connect()
+        
+        # Check and insert under one write lock, so concurrent setups
+        # can't both seed the decoy vault
+        with self._transaction(conn) as cursor:
+            cursor.execute('SELECT COUNT(*) FROM fake_media')
+            if cursor.fetchone()[0] > 0:
+                return
             
-            cursor.execute('''
+            cursor.executemany('''
                 INSERT INTO fake_media 
                 (filename, encrypted_path, thumbnail_path, folder_id, file_size, mimetype, upload_date)
                 VALUES (?, ?, ?, ?, ?, ?, datetime('now', '-' || ? || ' days'))
-            ''', (
-                filename,
-                fake_path,
-                fake_path + '.thumb',
-                'default',
-                file_size,
-                self._guess_mimetype(filename),
-                random.randint(0, 30)  # Random date in last 30 days
-            ))
+            ''', rows)
         
-        conn.commit()
-        conn.close()
+        self._release(conn)
         print(f"✅ Added {len(fake_files)} fake media items for decoy mode")
\ No newline at end of file